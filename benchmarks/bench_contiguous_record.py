@@ -0,0 +1,33 @@
+"""Benchmark of the retrieval of DataChunk from a ContiguousRecord.
+
+Compares the view returned when a slice falls inside a single DataChunk with
+the copy obtained with `ContiguousRecord.get(key, copy=True)`, while iterating
+a Data_Pipe-like list of slices over a long S_matrix.
+
+Usage:
+    python benchmarks/bench_contiguous_record.py
+"""
+import timeit
+
+import numpy as np
+
+from theonerig.core import DataChunk, ContiguousRecord
+
+def make_record(n_bins=60*60*60, n_cells=500):
+    main_tp = DataChunk(np.arange(n_bins), 0, "sync")
+    signals = DataChunk(np.zeros(n_bins), 0, "sync")
+    record  = ContiguousRecord(n_bins, signals, main_tp)
+    record["S_matrix"] = DataChunk(np.random.rand(n_bins, n_cells).astype(np.float32), 0, "cell")
+    return record
+
+def iterate(record, slices, copy):
+    for slice_ in slices:
+        record.get("S_matrix", slice_, copy=copy)
+
+if __name__ == "__main__":
+    record = make_record()
+    for seg_len in [600, 6000, 60000]:
+        slices = [slice(start, start+seg_len) for start in range(0, len(record)-seg_len, seg_len)]
+        for copy in [False, True]:
+            duration = min(timeit.repeat(lambda: iterate(record, slices, copy), number=1, repeat=3))
+            print("segment %6d bins, copy=%-5s: %8.2f ms for %d segments" % (seg_len, copy, duration*1000, len(slices)))
@@ -0,0 +1,39 @@
+"""Benchmark of the Data_Pipe mask operations.
+
+Builds records of increasing length with the same number of stimulus DataChunk,
+and times the composition of a Data_Pipe. With interval masks, the duration
+should not depend on the length of the record.
+
+Usage:
+    python benchmarks/bench_data_pipe.py
+"""
+import timeit
+
+import numpy as np
+
+from theonerig.core import DataChunk, RecordMaster, Data_Pipe
+
+def make_record(n_bins, n_stim=50):
+    main_tp = DataChunk(np.arange(n_bins), 0, "sync")
+    signals = DataChunk(np.zeros(n_bins, dtype=np.uint8), 0, "sync")
+    reM = RecordMaster([(main_tp, signals)])
+    reM[0]["S_matrix"] = DataChunk(np.zeros((n_bins, 1), dtype=np.uint8), 0, "cell")
+    stim_len = n_bins // (2*n_stim)
+    for i in range(n_stim):
+        name = ["checkerboard", "chirp", "fullfield"][i % 3]
+        reM[0][name] = DataChunk(np.zeros(stim_len, dtype=np.uint8), 2*i*stim_len, "stim")
+    return reM
+
+def compose(reM):
+    pipe = Data_Pipe(reM, "S_matrix")
+    pipe += "stim"
+    pipe -= "fullfield"
+    pipe &= ["checkerboard", "chirp"]
+    pipe ^= "chirp"
+    return pipe
+
+if __name__ == "__main__":
+    for n_bins in [60*60*10, 60*60*60*10, 60*60*60*100]:
+        reM = make_record(n_bins)
+        duration = min(timeit.repeat(lambda: compose(reM), number=10, repeat=3))/10
+        print("record of %10d bins: %8.3f ms per pipe composition" % (n_bins, duration*1000))
@@ -0,0 +1,69 @@
+"""Benchmark of the HDF5 layouts of export_record.
+
+For each layout, measures the export time of a record, the size of the file and
+the latency of reading random short time windows from a lazily imported record.
+The memory-mapped directory of export_record_dir is measured the same way.
+
+Usage:
+    python benchmarks/bench_export_record.py
+"""
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from theonerig.core import DataChunk, RecordMaster, export_record, export_record_dir, import_record
+
+LAYOUTS = {
+    "gzip4 (h5py chunks)":      dict(),
+    "gzip4, 600 bins":          dict(chunk_len=600),
+    "shuffle+gzip4, 600 bins":  dict(chunk_len=600, shuffle=True),
+    "shuffle+gzip4, 4 threads": dict(chunk_len=600, shuffle=True, n_jobs=4),
+    "shuffle+gzip4, compact":   dict(chunk_len=600, shuffle=True, compact=True),
+    "lzf, 600 bins":            dict(compression="lzf", chunk_len=600),
+    "uncompressed, 600 bins":   dict(compression=None, chunk_len=600),
+}
+
+def make_record(n_bins=60*60*20, n_cells=300):
+    main_tp = DataChunk(np.arange(n_bins)*500, 0, "sync")
+    signals = DataChunk(np.zeros(n_bins), 0, "sync")
+    reM = RecordMaster([(main_tp, signals)])
+    reM[0]["checkerboard"] = DataChunk(np.random.choice([-1., 1.], size=(n_bins, 24, 32)), 0, "stim")
+    reM[0]["S_matrix"]     = DataChunk(np.random.poisson(.1, size=(n_bins, n_cells)).astype(float), 0, "cell")
+    return reM
+
+def window_latency(path, n_windows=200, window=60):
+    with import_record(path, lazy=True) as reM:
+        seq    = reM[0]
+        starts = np.random.randint(0, len(seq)-window, n_windows)
+        t0 = time.perf_counter()
+        for start in starts:
+            seq.get("checkerboard", slice(start, start+window))
+            seq.get("S_matrix", slice(start, start+window))
+        return (time.perf_counter()-t0)/n_windows
+
+if __name__ == "__main__":
+    reM = make_record()
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name, kwargs in LAYOUTS.items():
+            path = os.path.join(tmp_dir, "record_master.h5")
+            t0 = time.perf_counter()
+            export_record(path, reM, **kwargs)
+            export_time = time.perf_counter()-t0
+            results.append((name, export_time, os.path.getsize(path)/2**20, window_latency(path)))
+            os.remove(path)
+
+        path = os.path.join(tmp_dir, "record_master")
+        t0 = time.perf_counter()
+        export_record_dir(path, reM)
+        export_time = time.perf_counter()-t0
+        size = sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(path) for f in files)
+        results.append(("npy directory (mmap)", export_time, size/2**20, window_latency(path)))
+        shutil.rmtree(path)
+
+    print("%-26s %10s %10s %14s" % ("layout", "export (s)", "size (MB)", "1s window (ms)"))
+    for name, export_time, size, latency in results:
+        print("%-26s %10.2f %10.1f %14.2f" % (name, export_time, size, latency*1000))
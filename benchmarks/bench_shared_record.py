@@ -0,0 +1,49 @@
+"""Benchmark of the transfer of a RecordMaster to multiprocessing workers.
+
+Compares sending the pickled RecordMaster to each task with sending the `spec`
+of a SharedRecord, from which the workers attach the shared memory blocks.
+
+Usage:
+    python benchmarks/bench_shared_record.py
+"""
+import multiprocessing
+import time
+
+import numpy as np
+
+from theonerig.core import DataChunk, RecordMaster, SharedRecord, attach_record
+
+def make_record(n_bins=60*60*20, n_cells=300):
+    main_tp = DataChunk(np.arange(n_bins)*500, 0, "sync")
+    signals = DataChunk(np.zeros(n_bins), 0, "sync")
+    reM = RecordMaster([(main_tp, signals)])
+    reM[0]["checkerboard"] = DataChunk(np.random.choice([-1., 1.], size=(n_bins, 24, 32)), 0, "stim")
+    reM[0]["S_matrix"]     = DataChunk(np.random.poisson(.1, size=(n_bins, n_cells)).astype(float), 0, "cell")
+    return reM
+
+def cell_mean(args):
+    reM, cell = args
+    return float(np.mean(reM[0]["S_matrix"][:, cell]))
+
+def cell_mean_shared(args):
+    spec, cell = args
+    reM = attach_record(spec)
+    res = float(np.mean(reM[0]["S_matrix"][:, cell]))
+    reM.close()
+    return res
+
+if __name__ == "__main__":
+    reM     = make_record()
+    n_tasks = 32
+    with multiprocessing.Pool(4) as pool:
+        t0 = time.perf_counter()
+        pool.map(cell_mean, [(reM, cell) for cell in range(n_tasks)], chunksize=1)
+        print("pickled RecordMaster: %8.2f s for %d tasks" % (time.perf_counter()-t0, n_tasks))
+
+        t0 = time.perf_counter()
+        with SharedRecord(reM) as shared:
+            share_time = time.perf_counter()-t0
+            shared_str = str(shared)
+            pool.map(cell_mean_shared, [(shared.spec, cell) for cell in range(n_tasks)], chunksize=1)
+        print("SharedRecord:         %8.2f s for %d tasks (%.2f s to share %s)" % (time.perf_counter()-t0, n_tasks,
+                                                                                 share_time, shared_str))
@@ -2,20 +2,35 @@
 
 __all__ = ["index", "modules", "custom_doc_links", "git_url"]
 
-index = {"DataChunk": "00_core.ipynb",
+index = {"compact_dtype": "00_core.ipynb",
+         "DataChunk": "00_core.ipynb",
+         "LazyDataChunk": "00_core.ipynb",
+         "RLEDataChunk": "00_core.ipynb",
+         "rle_encode": "00_core.ipynb",
+         "SparseDataChunk": "00_core.ipynb",
+         "ChunkCache": "00_core.ipynb",
          "ContiguousRecord": "00_core.ipynb",
          "RecordMaster": "00_core.ipynb",
          "Data_Pipe": "00_core.ipynb",
          "export_record": "00_core.ipynb",
+         "export_record_dir": "00_core.ipynb",
          "import_record": "00_core.ipynb",
+         "SharedRecord": "00_core.ipynb",
+         "attach_record": "00_core.ipynb",
          "extend_sync_timepoints": "01_utils.ipynb",
          "align_sync_timepoints": "01_utils.ipynb",
          "resample_to_timepoints": "01_utils.ipynb",
+         "bin_to_timepoints": "01_utils.ipynb",
          "flip_stimulus": "01_utils.ipynb",
          "flip_gratings": "01_utils.ipynb",
          "stim_to_dataChunk": "01_utils.ipynb",
+         "ClusterIndex": "01_utils.ipynb",
+         "build_cluster_index": "01_utils.ipynb",
+         "load_cluster_index": "01_utils.ipynb",
+         "PhyResults": "01_utils.ipynb",
          "phy_results_dict": "01_utils.ipynb",
          "spike_to_dataChunk": "01_utils.ipynb",
+         "phy_spike_to_dataChunk": "01_utils.ipynb",
          "get_calcium_stack_lenghts": "01_utils.ipynb",
          "twoP_dataChunks": "01_utils.ipynb",
          "img_2d_fit": "01_utils.ipynb",
@@ -32,6 +47,8 @@ index = {"DataChunk": "00_core.ipynb",
          "smooth_eye_position": "02_processing.ipynb",
          "process_sta_batch": "02_processing.ipynb",
          "staEst_fromBins": "02_processing.ipynb",
+         "staEst_fromRuns": "02_processing.ipynb",
+         "staEst_fromSparse": "02_processing.ipynb",
          "process_sta_batch_large": "02_processing.ipynb",
          "cross_correlation": "02_processing.ipynb",
          "corrcoef": "02_processing.ipynb",
@@ -1,28 +1,71 @@
 # AUTOGENERATED! DO NOT EDIT! File to edit: 00_core.ipynb (unless otherwise specified).
 
-__all__ = ['DataChunk', 'ContiguousRecord', 'RecordMaster', 'Data_Pipe', 'export_record', 'import_record']
+__all__ = ['compact_dtype', 'DataChunk', 'LazyDataChunk', 'RLEDataChunk', 'rle_encode', 'SparseDataChunk', 'ChunkCache',
+           'ContiguousRecord', 'RecordMaster', 'Data_Pipe', 'export_record', 'export_record_dir', 'import_record',
+           'SharedRecord', 'attach_record']
 
 # Cell
 import h5py
 import json
+import os
 import numpy as np
-from collections import namedtuple
-from typing import Dict, Tuple, Sequence, Union
+import scipy.sparse as sp_sparse
+from collections import namedtuple, OrderedDict
+from typing import Dict, Tuple, Sequence, Union, Callable
 import itertools
+import bisect
+import zlib
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+import sys
+import threading
+import queue
 import matplotlib.pyplot as plt
 from matplotlib.patches import Patch
 
+_COMPACT_INT_DTYPES = [np.uint8, np.int8, np.uint16, np.int16, np.uint32, np.int32, np.int64]
+
+def compact_dtype(data, fill=None) -> np.dtype:
+    """Smallest dtype holding exactly the values of data (and the filling value fill if given):
+    the smallest integer dtype for integer values, like spike counts (uint8/uint16) or binary stimuli
+    (int8), float32 for float64 values exact in single precision, the dtype of data otherwise.
+    The candidate dtype is verified by comparing the casted values to the original ones."""
+    data = np.asarray(data)
+    if data.dtype.kind not in "iuf" or data.size == 0:
+        return data.dtype
+    with np.errstate(invalid="ignore", over="ignore"):
+        is_integer = data.dtype.kind in "iu" or (np.all(np.isfinite(data)) and np.all(np.floor(data) == data))
+        candidates = []
+        if is_integer:
+            data_min, data_max = data.min(), data.max()
+            candidates = [dtype for dtype in _COMPACT_INT_DTYPES
+                          if np.iinfo(dtype).min <= data_min and data_max <= np.iinfo(dtype).max][:1]
+        if data.dtype == np.float64:
+            candidates.append(np.float32)
+        for dtype in candidates:
+            if np.dtype(dtype).itemsize >= data.dtype.itemsize:
+                continue
+            if fill is not None and not np.array_equal(np.asarray(fill).astype(dtype), fill, equal_nan=True):
+                continue
+            if np.array_equal(data.astype(dtype), data, equal_nan=data.dtype.kind=="f"):
+                return np.dtype(dtype)
+    return data.dtype
+
 class DataChunk(np.ndarray):
     """Base brick of data. Derived from np.ndarray
     params:
         - data: The ndarray with shape (time, ...)
         - idx: Index of the start of the DataChunk in the record.
         - group: group of the DataChunk in {stim, sync, cell, data}
-        - fill: Default filling value."""
-    def __new__(cls, data, idx, group, fill=0):
+        - fill: Default filling value.
+        - compact: If True, data is stored with its `compact_dtype` (lossless)."""
+    def __new__(cls, data, idx, group, fill=0, compact=False):
         # See https://docs.scipy.org/doc/numpy-1.11.0/user/basics.subclassing.html#basics-subclassing
         # for explanation on subclassing numpy arrays
-        obj = np.asarray(data).view(cls)
+        data = np.asarray(data)
+        if compact:
+            data = data.astype(compact_dtype(data, fill), copy=False)
+        obj = data.view(cls)
         obj.idx = idx
         obj.group = group
         obj.fill = fill
@@ -38,6 +81,19 @@ class DataChunk(np.ndarray):
         self.fill  = getattr(obj, 'fill', 0)
         self.attrs = getattr(obj, 'attrs', {})
 
+    def __reduce__(self):
+        #The attributes are pickled with the array, for multiprocessing
+        reconstruct, args, state = super().__reduce__()
+        return reconstruct, args, (state, self.idx, self.group, self.fill, self.attrs)
+
+    def __setstate__(self, state):
+        if not isinstance(state[0], tuple): #Plain ndarray state, pickled without the attributes
+            super().__setstate__(state)
+            self.idx, self.group, self.fill, self.attrs = None, None, 0, {}
+            return
+        state, self.idx, self.group, self.fill, self.attrs = state
+        super().__setstate__(state)
+
 
     @property
     def range(self):
@@ -57,12 +113,342 @@ class DataChunk(np.ndarray):
         return "DataChunk(%s,%s,%s,%s)"%(self.shape, self.idx, self.group, self.fill)
 
 # Cell
+class LazyDataChunk():
+    """DataChunk whose data stays on disk in an open h5py dataset. Only the rows requested
+    by slicing are read from the file, and returned as a DataChunk.
+    params:
+        - dataset: The h5py dataset with shape (time, ...)
+        - idx: Index of the start of the DataChunk in the record.
+        - group: group of the DataChunk in {stim, sync, cell, data}
+        - fill: Default filling value.
+        - dtype: dtype of the rows read, if different of the dtype of the dataset"""
+    def __init__(self, dataset, idx, group, fill=0, dtype=None):
+        self.dataset = dataset
+        self.idx     = idx
+        self.group   = group
+        self.fill    = fill
+        self._dtype  = None if dtype is None else np.dtype(dtype)
+
+        self.attrs = {}
+
+    @property
+    def shape(self):
+        return self.dataset.shape
+
+    @property
+    def dtype(self):
+        return self.dataset.dtype if self._dtype is None else self._dtype
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def range(self):
+        return range(self.idx, self.idx + len(self))
+
+    @property
+    def slice(self):
+        return slice(self.idx, self.idx + len(self))
+
+    def __len__(self):
+        return self.shape[0]
+
+    def _read(self, key):
+        data = self.dataset[key]
+        if self._dtype is not None:
+            data = np.asarray(data).astype(self._dtype)
+        return data
+
+    def __getitem__(self, key):
+        if isinstance(key, slice) and key.step in [None, 1]:
+            start, stop, _ = key.indices(len(self))
+            stop      = max(start, stop)
+            datachunk = DataChunk(self._read(slice(start, stop)), self.idx+start, self.group, self.fill)
+            datachunk.attrs = dict(self.attrs)
+            return datachunk
+        return self._read(key)
+
+    def __array__(self, dtype=None, copy=None):
+        data = self._read(())
+        if dtype is not None:
+            data = data.astype(dtype)
+        return data
+
+    def load(self) -> DataChunk:
+        """Read the whole dataset and return it as a DataChunk"""
+        return self[:]
+
+    def __repr__(self):
+        return "LazyDataChunk(%s,%s,%s,%s)"%(self.shape, self.idx, self.group, self.fill)
+
+# Cell
+class RLEDataChunk():
+    """DataChunk of a stimulus stored as runs of repeated frames, like the compressed arrays of QDSpy.
+    The frames are only expanded when reading them, and slicing the frames returns a RLEDataChunk.
+    params:
+        - values: The frame of each run, with shape (n_run, ...)
+        - lengths: Number of repetition of each run's frame
+        - idx: Index of the start of the DataChunk in the record.
+        - group: group of the DataChunk in {stim, sync, cell, data}
+        - fill: Default filling value."""
+    def __init__(self, values, lengths, idx, group="stim", fill=0):
+        self.values  = np.asarray(values)
+        self.lengths = np.asarray(lengths, dtype=int)
+        self._stops  = np.cumsum(self.lengths)
+        self.idx     = idx
+        self.group   = group
+        self.fill    = fill
+
+        self.attrs = {}
+
+    @property
+    def shape(self):
+        return (int(self._stops[-1]) if len(self._stops) else 0, *self.values.shape[1:])
+
+    @property
+    def dtype(self):
+        return self.values.dtype
+
+    @property
+    def ndim(self):
+        return self.values.ndim
+
+    @property
+    def range(self):
+        return range(self.idx, self.idx + len(self))
+
+    @property
+    def slice(self):
+        return slice(self.idx, self.idx + len(self))
+
+    def __len__(self):
+        return self.shape[0]
+
+    def run_index(self, frames):
+        """Index of the runs containing the given frames"""
+        return np.searchsorted(self._stops, frames, side="right")
+
+    def map_values(self, func):
+        """Returns a new RLEDataChunk with func applied to the values of the runs (frame-wise operations only)"""
+        rle_chunk = RLEDataChunk(func(self.values), self.lengths, self.idx, self.group, self.fill)
+        rle_chunk.attrs = dict(self.attrs)
+        return rle_chunk
+
+    def __getitem__(self, key):
+        if isinstance(key, slice) and key.step in [None, 1]:
+            start, stop, _ = key.indices(len(self))
+            stop = max(start, stop)
+            if start == stop:
+                first, last = 0, 0
+            else:
+                first, last = self.run_index(start), self.run_index(stop-1)+1
+            stops     = np.minimum(self._stops[first:last], stop) - start
+            rle_chunk = RLEDataChunk(self.values[first:last], np.diff(stops, prepend=0),
+                                     self.idx+start, self.group, self.fill)
+            rle_chunk.attrs = dict(self.attrs)
+            return rle_chunk
+        elif isinstance(key, (int, np.integer)):
+            return self.values[self.run_index(key % len(self))]
+        elif isinstance(key, slice):
+            return self.values[self.run_index(np.arange(*key.indices(len(self))))]
+        elif isinstance(key, (list, np.ndarray)) and np.asarray(key).dtype.kind in "iu":
+            return self.values[self.run_index(np.asarray(key) % len(self))]
+        return np.asarray(self)[key]
+
+    def __array__(self, dtype=None, copy=None):
+        data = np.repeat(self.values, self.lengths, axis=0)
+        if dtype is not None:
+            data = data.astype(dtype)
+        return data
+
+    def copy(self):
+        rle_chunk = RLEDataChunk(self.values.copy(), self.lengths.copy(), self.idx, self.group, self.fill)
+        rle_chunk.attrs = dict(self.attrs)
+        return rle_chunk
+
+    def load(self) -> DataChunk:
+        """Expand the frames and return them as a DataChunk"""
+        datachunk = DataChunk(np.asarray(self), self.idx, self.group, self.fill)
+        datachunk.attrs = dict(self.attrs)
+        return datachunk
+
+    def __repr__(self):
+        return "RLEDataChunk(%s,%s,%s,%s,%d runs)"%(self.shape, self.idx, self.group, self.fill, len(self.lengths))
+
+def rle_encode(data, idx:int, group="stim", fill=0) -> RLEDataChunk:
+    """Encodes the consecutive identical frames of data (of shape (t, ...)) as runs of a RLEDataChunk."""
+    data = np.asarray(data)
+    if len(data) == 0:
+        return RLEDataChunk(data, [], idx, group, fill)
+    changes = np.any(np.reshape(data[1:] != data[:-1], (len(data)-1, -1)), axis=1)
+    starts  = np.concatenate(([0], np.where(changes)[0]+1))
+    return RLEDataChunk(data[starts], np.diff(starts, append=len(data)), idx, group, fill)
+
+# Cell
+class SparseDataChunk():
+    """DataChunk of a matrix of shape (time, n) stored as a scipy.sparse CSR matrix, with one row per
+    bin, like the spike counts of cells. The rows are only densified when reading them, and slicing the
+    rows returns a SparseDataChunk.
+    params:
+        - matrix: scipy.sparse matrix (or array) of shape (time, n)
+        - idx: Index of the start of the DataChunk in the record.
+        - group: group of the DataChunk in {stim, sync, cell, data}
+        - fill: Default filling value."""
+    def __init__(self, matrix, idx, group="cell", fill=0):
+        self.matrix = sp_sparse.csr_matrix(matrix)
+        self.idx    = idx
+        self.group  = group
+        self.fill   = fill
+
+        self.attrs = {}
+
+    @property
+    def shape(self):
+        return self.matrix.shape
+
+    @property
+    def dtype(self):
+        return self.matrix.dtype
+
+    @property
+    def ndim(self):
+        return 2
+
+    @property
+    def nnz(self):
+        return self.matrix.nnz
+
+    @property
+    def range(self):
+        return range(self.idx, self.idx + len(self))
+
+    @property
+    def slice(self):
+        return slice(self.idx, self.idx + len(self))
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        if isinstance(key, slice) and key.step in [None, 1]:
+            start, stop, _ = key.indices(len(self))
+            stop = max(start, stop)
+            sparse_chunk = SparseDataChunk(self.matrix[start:stop], self.idx+start, self.group, self.fill)
+            sparse_chunk.attrs = dict(self.attrs)
+            return sparse_chunk
+        elif isinstance(key, (int, np.integer)):
+            return self.matrix[key].toarray()[0]
+        elif isinstance(key, slice) or (isinstance(key, (list, np.ndarray)) and np.asarray(key).dtype.kind in "iu"):
+            return self.matrix[key].toarray()
+        return np.asarray(self)[key]
+
+    def __array__(self, dtype=None, copy=None):
+        data = self.matrix.toarray()
+        if dtype is not None:
+            data = data.astype(dtype)
+        return data
+
+    def copy(self):
+        sparse_chunk = SparseDataChunk(self.matrix.copy(), self.idx, self.group, self.fill)
+        sparse_chunk.attrs = dict(self.attrs)
+        return sparse_chunk
+
+    def load(self) -> DataChunk:
+        """Densify the rows and return them as a DataChunk"""
+        datachunk = DataChunk(np.asarray(self), self.idx, self.group, self.fill)
+        datachunk.attrs = dict(self.attrs)
+        return datachunk
+
+    def __repr__(self):
+        return "SparseDataChunk(%s,%s,%s,%s,%d nnz)"%(self.shape, self.idx, self.group, self.fill, self.nnz)
+
+# Cell
+class ChunkCache():
+    """LRU cache of the arrays assembled (or read from disk, or expanded) by the ContiguousRecord
+    of a RecordMaster, enabled with `RecordMaster.enable_cache`. Entries are keyed by
+    (sequence, name, start, stop, expand) and the least recently used are evicted when their total
+    size exceeds max_bytes. Views on the stored data are not cached, as they cost nothing to create.
+    The cached arrays are returned to every caller and are thus read-only.
+    params:
+        - max_bytes: Memory budget of the cache in bytes"""
+    def __init__(self, max_bytes:int=2**30):
+        self.max_bytes = max_bytes
+        self.n_bytes   = 0
+        self.hits      = 0
+        self.misses    = 0
+        self._entries  = OrderedDict()
+        self._lock     = threading.Lock()
+
+    def get(self, key:tuple):
+        """Returns the cached DataChunk of key, or None"""
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key:tuple, datachunk:DataChunk):
+        """Caches datachunk under key, evicting the least recently used entries if needed"""
+        if datachunk.nbytes > self.max_bytes:
+            return
+        datachunk.flags.writeable = False
+        with self._lock:
+            if key in self._entries:
+                self.n_bytes -= self._entries.pop(key).nbytes
+            self._entries[key] = datachunk
+            self.n_bytes += datachunk.nbytes
+            while self.n_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.n_bytes -= evicted.nbytes
+
+    def invalidate(self, record_uid:int, name:str):
+        """Removes the entries of the given name of a ContiguousRecord"""
+        with self._lock:
+            for key in [key for key in self._entries if key[:2] == (record_uid, name)]:
+                self.n_bytes -= self._entries.pop(key).nbytes
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.n_bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __repr__(self):
+        return "ChunkCache(%d entries, %d/%d bytes, %d hits, %d misses)"%(len(self), self.n_bytes, self.max_bytes,
+                                                                         self.hits, self.misses)
+
+# Cell
+_record_uids = itertools.count()
+
+def _overlap_range(starts:list, stops:list, start:int, stop:int) -> Tuple[int, int]:
+    """Returns the (first, last+1) positions of the intervals [starts[i], stops[i]) overlapping [start, stop),
+    for sorted non-overlapping non-empty intervals."""
+    first = bisect.bisect_right(stops, start)
+    last  = bisect.bisect_left(starts, stop)
+    return first, max(first, last)
+
+def _common_dtype(datachunks:list, fill) -> np.dtype:
+    """dtype holding the values of all datachunks, which may differ once compacted, and their filling value"""
+    dtype = np.result_type(*[datachunk.dtype for datachunk in datachunks])
+    with np.errstate(invalid="ignore", over="ignore"):
+        if fill is not None and not np.array_equal(np.asarray(fill).astype(dtype), fill, equal_nan=True):
+            dtype = np.result_type(dtype, np.min_scalar_type(fill))
+    return dtype
+
 class ContiguousRecord():
     """Representation of a contiguous recording session to store DataChunk
     of various sources under a single time reference. DataChunk are stored
     under a name in one of the groups "sync","stim","data" and "cell".
 
     A name can contain multiple DataChunk if those are not overlapping in time.
+    They are kept sorted by their starting index, along with the start and stop
+    indexes of each DataChunk, so that overlap checks and the selection of the
+    DataChunk of a slice are made by bisection.
 
     Each ContiguousRecord contains in the group "sync" two master DataChunk,
     one for signals to be recorded across acquisition device to syncronize them,
@@ -82,6 +468,10 @@ class ContiguousRecord():
         """
         self.length = length
         self._data_dict = {}
+        self._starts    = {}
+        self._stops     = {}
+        self._cache     = None #ChunkCache shared with the RecordMaster, if enabled
+        self._uid       = next(_record_uids)
 
         self[self.SIGNALS] = signals
         self[self.MAIN_TP] = main_tp
@@ -89,28 +479,47 @@ class ContiguousRecord():
         self._slice = slice(0,self.length,1)
 
     def dataset_intersect(self, existing_datachunk:list, new_datachunk:DataChunk):
-        """Check for timepoint intersections of two DataChunks"""
-        range_new = set(new_datachunk.range)
-        intersect = False
-        for range_existing in existing_datachunk:
-            intersect |= len(range_new.intersection(range_existing.range)) > 0
-        return intersect
+        """Check for timepoint intersections of two DataChunks, with the rule used when setting
+        a DataChunk (see `_overlap_range`). Empty DataChunk intersect nothing."""
+        if len(new_datachunk) == 0:
+            return False
+        existing_datachunk = [datachunk for datachunk in existing_datachunk if len(datachunk) > 0]
+        starts = sorted(datachunk.idx for datachunk in existing_datachunk)
+        stops  = sorted(datachunk.idx + len(datachunk) for datachunk in existing_datachunk)
+        first, last = _overlap_range(starts, stops, new_datachunk.idx, new_datachunk.idx + len(new_datachunk))
+        return first != last
+
+    def _chunk_range(self, datachunk_name:str, start:int, stop:int) -> Tuple[int, int]:
+        """Returns the (first, last+1) positions in the sorted DataChunk list of datachunk_name
+        of the DataChunk overlapping the bins [start, stop)"""
+        return _overlap_range(self._starts[datachunk_name], self._stops[datachunk_name], start, stop)
 
     def keys(self):
         """Retrieves the existing keyys inside this ContiguousRecord"""
         return self._data_dict.keys()
 
-    def get_slice(self, datachunk_name:str) -> list:
-        """Returns the slices of the DataChunk corresponding to the given key"""
-        if datachunk_name in self._data_dict.keys():
-            return [chunk.slice for chunk in self._data_dict[datachunk_name]]
-        else:
+    def get_slice(self, datachunk_name:str, slice_:slice=None) -> list:
+        """Returns the slices of the DataChunk corresponding to the given key.
+        If slice_ is given, only the slices of the DataChunk overlapping it are returned."""
+        if datachunk_name not in self._data_dict.keys():
             return []
+        first, last = 0, len(self._starts[datachunk_name])
+        if slice_ is not None:
+            start = 0 if slice_.start is None else slice_.start
+            stop  = self.length if slice_.stop is None else slice_.stop
+            first, last = self._chunk_range(datachunk_name, start, stop)
+        return [slice(start, stop) for start, stop in zip(self._starts[datachunk_name][first:last],
+                                                          self._stops[datachunk_name][first:last])]
 
     def set_slice(self, slice_):
-        """Set the slice to restrict the size of the DataChunk returned"""
+        """Set the slice to restrict the size of the DataChunk returned by `get` and indexing.
+        This state is shared by all users of the record: to read a slice from concurrent code,
+        give it to `get` instead."""
+        self._slice = self._normalize_slice(slice_)
+
+    def _normalize_slice(self, slice_) -> slice:
         if slice_ is None:
-            self._slice = slice(0,self.length,1)
+            return slice(0,self.length,1)
         else:
             start, stop, step = slice_.start, slice_.stop, slice_.step
             if start is None:
@@ -121,9 +530,9 @@ class ContiguousRecord():
                 step = 1
             if step!=1:
                 print("Step in slice is currently not supported.")
-                self._slice = slice(0,self.length,1)
+                return slice(0,self.length,1)
             else:
-                self._slice = slice(start,stop,step)
+                return slice(start,stop,step)
 
 
     def get_names_group(self, group_name:str) -> list:
@@ -140,39 +549,171 @@ class ContiguousRecord():
         if isinstance(key, str):
             if key not in self._data_dict.keys():
                 self._data_dict[key] = []
+                self._starts[key]    = []
+                self._stops[key]     = []
+            if self._cache is not None:
+                self._cache.invalidate(self._uid, key)
 
-            if not self.dataset_intersect(self._data_dict[key], value):
+            if len(value) == 0: #Holds no bin: kept after the DataChunk indexed by _starts and _stops
                 self._data_dict[key].append(value)
+                return
+            first, last = self._chunk_range(key, value.idx, value.idx + len(value))
+            if first == last:
+                self._data_dict[key].insert(first, value)
+                self._starts[key].insert(first, value.idx)
+                self._stops[key].insert(first, value.idx + len(value))
             else:
                 raise ValueError("Data with the same name already exists and intersect with the one provided")
         else:
             raise KeyError("Cannot set data with an integer index, it needs a name")
 
-    def __getitem__(self, key):
-        if isinstance(key, str):
-            l_datachunk = self._data_dict[key]
-            fill_value  = l_datachunk[0].fill
-            shape       = l_datachunk[0].shape
-
-            full_sequence = DataChunk(np.zeros((len(range(*self._slice.indices(self.length))), *shape[1:]),
-                                               dtype=l_datachunk[0].dtype)+fill_value,
-                                      self._slice.start if self._slice.start is not None else 0,
-                                      fill_value)
-            for datachunk in l_datachunk:
-                dc_slice = datachunk.slice
-                if dc_slice.start>=self._slice.stop or dc_slice.stop<=self._slice.start:
-                    continue
+    def get(self, key:str, slice_:slice=None, copy:bool=False, expand:bool=True) -> DataChunk:
+        """Retrieves the data stored under key for slice_, or for the current slice of the record
+        (see `set_slice`) if slice_ is None. Reading with slice_ does not modify the record, so that
+        multiple threads can read it concurrently.
+
+        When the slice falls inside a single DataChunk, the returned DataChunk is a view
+        on the stored data (no copy), otherwise the DataChunk are assembled in a new array
+        where bins without data take the filling value.
+        Only the requested rows of a RLEDataChunk or SparseDataChunk are expanded.
+
+        params:
+            - key: Name of the DataChunk to retrieve
+            - slice_: Slice of the record to retrieve, overriding the slice set with `set_slice`
+            - copy: Set to True to always obtain a new array, safe to modify
+            - expand: Set to False to obtain a RLEDataChunk or SparseDataChunk, when the slice falls inside a single one
+
+        return:
+            - DataChunk of the data over the slice
+        """
+        slice_      = self._slice if slice_ is None else self._normalize_slice(slice_)
+        first, last = self._chunk_range(key, slice_.start, min(slice_.stop, self.length))
+        return self._cached_read(key, slice_, first, last, copy, expand)
+
+    def get_slices(self, key:str, slices:Sequence[slice], copy:bool=False, expand:bool=True) -> list:
+        """Retrieves the data stored under key for each of the slices, like `get`. The DataChunk
+        overlapping each slice are all located in a single vectorized search.
+
+        params:
+            - key: Name of the DataChunk to retrieve
+            - slices: List of slices of the record to retrieve
+            - copy: Set to True to always obtain new arrays, safe to modify
+            - expand: Set to False to obtain RLEDataChunk or SparseDataChunk, when a slice falls inside a single one
+
+        return:
+            - List of the DataChunk of each slice
+        """
+        slices = [self._normalize_slice(slice_) for slice_ in slices]
+        starts = np.array([slice_.start for slice_ in slices], dtype=int)
+        stops  = np.minimum([slice_.stop for slice_ in slices], self.length).astype(int)
+        firsts = np.searchsorted(self._stops[key], starts, side="right")
+        lasts  = np.maximum(firsts, np.searchsorted(self._starts[key], stops, side="left"))
+        return [self._cached_read(key, slice_, first, last, copy, expand)
+                for slice_, first, last in zip(slices, firsts, lasts)]
+
+    def gather(self, names:Sequence[str], slice_:slice=None, out:Dict[str, np.ndarray]=None,
+               copy:bool=False, expand:bool=True) -> Dict[str, DataChunk]:
+        """Retrieves the data of several names over slice_ (or the current slice of the record) in a
+        single call, like `get` does for one name.
+
+        params:
+            - names: Names of the DataChunk to retrieve
+            - slice_: Slice of the record to retrieve, overriding the slice set with `set_slice`
+            - out: Dictionary of preallocated arrays of shape (len(slice_), ...), for some or all of the
+            names. The data of those names is written in them instead of new arrays, and the returned
+            DataChunk share their memory.
+            - copy: Set to True to always obtain new arrays, safe to modify
+            - expand: Set to False to obtain RLEDataChunk or SparseDataChunk, when the slice falls inside a single one
+
+        return:
+            - Dictionary of the DataChunk of each name
+        """
+        slice_ = self._slice if slice_ is None else self._normalize_slice(slice_)
+        start, stop = slice_.start, min(slice_.stop, self.length)
+        out = {} if out is None else out
+        res = {}
+        for name in names:
+            first, last = self._chunk_range(name, start, stop)
+            if name in out:
+                res[name] = self._read(name, slice_, first, last, copy, expand, out[name])
+            else:
+                res[name] = self._cached_read(name, slice_, first, last, copy, expand)
+        return res
+
+    def _cached_read(self, key:str, slice_:slice, first:int, last:int, copy:bool, expand:bool) -> DataChunk:
+        """Reads slice_ of the DataChunk list of key through the ChunkCache, if enabled"""
+        if self._cache is None or self._is_view_read(key, slice_, first, last, expand):
+            return self._read(key, slice_, first, last, copy, expand)
+        cache_key = (self._uid, key, slice_.start, min(slice_.stop, self.length), expand)
+        datachunk = self._cache.get(cache_key)
+        if datachunk is None:
+            datachunk = self._read(key, slice_, first, last, False, expand)
+            self._cache.put(cache_key, datachunk)
+        if copy:
+            return datachunk.copy()
+        if isinstance(datachunk, DataChunk):
+            datachunk = datachunk.view(DataChunk) #Own attributes dict for each caller
+            datachunk.attrs = dict(datachunk.attrs)
+        return datachunk
+
+    def _is_view_read(self, key:str, slice_:slice, first:int, last:int, expand:bool) -> bool:
+        """True if reading slice_ returns a view on a stored DataChunk (or an unexpanded RLEDataChunk
+        or SparseDataChunk), which is cheap and must not be cached"""
+        if last-first != 1:
+            return False
+        datachunk = self._data_dict[key][first]
+        if not (datachunk.idx <= slice_.start and min(slice_.stop, self.length) <= datachunk.idx + len(datachunk)):
+            return False
+        return isinstance(datachunk, np.ndarray) or (isinstance(datachunk, (RLEDataChunk, SparseDataChunk)) and not expand)
+
+    def _read(self, key:str, slice_:slice, first:int, last:int, copy:bool, expand:bool,
+              out:np.ndarray=None) -> DataChunk:
+        """Reads slice_ of the DataChunk list of key, knowing the positions [first, last) of
+        the DataChunk overlapping it. The data is written in out if given."""
+        l_datachunk = self._data_dict[key]
+        slice_start = slice_.start
+        slice_stop  = min(slice_.stop, self.length)
+        if last-first == 1 and out is None:
+            datachunk = l_datachunk[first]
+            if datachunk.idx <= slice_start and slice_stop <= datachunk.idx + len(datachunk):
+                sub_chunk = datachunk[slice_start-datachunk.idx:slice_stop-datachunk.idx]
+                if isinstance(sub_chunk, (RLEDataChunk, SparseDataChunk)) and expand:
+                    sub_chunk = sub_chunk.load()
+                elif copy:
+                    sub_chunk = sub_chunk.copy()
+                sub_chunk.idx   = slice_start
+                sub_chunk.attrs = dict(datachunk.attrs)
+                return sub_chunk
+
+        fill_value = l_datachunk[0].fill
+        shape      = (len(range(*slice_.indices(self.length))), *l_datachunk[0].shape[1:])
+        if out is None:
+            data = np.empty(shape, dtype=_common_dtype(l_datachunk[first:last] or l_datachunk[:1], fill_value))
+        elif out.shape != shape:
+            raise ValueError("out buffer of %s has shape %s instead of %s" % (key, out.shape, shape))
+        else:
+            data = out
+        full_sequence = DataChunk(data, slice_start, l_datachunk[0].group, fill_value)
+        cursor = slice_start #Bins before cursor are already written
+        for datachunk in l_datachunk[first:last]:
+            dc_slice = datachunk.slice
 
-                start = max(dc_slice.start, self._slice.start) #flooring to the maximum of both start
-                stop  = min(dc_slice.stop, self._slice.stop) # and capping to the min of both end
+            start = max(dc_slice.start, slice_start) #flooring to the maximum of both start
+            stop  = min(dc_slice.stop, slice_stop) # and capping to the min of both end
 
-                new_dc_slice  = slice(start-datachunk.idx, stop-datachunk.idx)
-                res_start = self._slice.start if self._slice.start is not None else 0
-                res_slice = slice(start-res_start, stop-res_start)
-                full_sequence[res_slice] = datachunk.data[new_dc_slice]
-                full_sequence.attrs.update(datachunk.attrs)
+            new_dc_slice  = slice(start-datachunk.idx, stop-datachunk.idx)
+            res_slice     = slice(start-slice_start, stop-slice_start)
+            full_sequence[cursor-slice_start:res_slice.start] = fill_value
+            full_sequence[res_slice] = datachunk[new_dc_slice]
+            full_sequence.attrs.update(datachunk.attrs)
+            cursor = stop
+        full_sequence[cursor-slice_start:] = fill_value
 
-            return full_sequence
+        return full_sequence
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self.get(key)
 
     def __iter__(self):
         groups = {"sync":[],"stim":[],"data":[],"cell":[]}
@@ -197,7 +738,11 @@ class ContiguousRecord():
             raise StopIteration
 
     def __delitem__(self, key):
+        if self._cache is not None:
+            self._cache.invalidate(self._uid, key)
         del self._data_dict[key]
+        del self._starts[key]
+        del self._stops[key]
 
     def __str__(self):
         res = "ContiguousRecord:\n"
@@ -239,6 +784,8 @@ class RecordMaster(list):
         self._frame_time = 1/frame_rate
         self._sep_size   = 1000 #Used for the plotting of multiple sequences
         self._sequences = []
+        self._files     = [] #Files kept open for the LazyDataChunk, or shared memory blocks
+        self.cache      = None
         for ref_timepoints, ref_signals in reference_data_list:
             cs = ContiguousRecord(len(ref_timepoints), ref_signals, ref_timepoints)
             self._sequences.append(cs)
@@ -249,12 +796,29 @@ class RecordMaster(list):
 
     def append(self, ref_timepoints:DataChunk, ref_signals:DataChunk):
         cs = ContiguousRecord(len(ref_timepoints), ref_signals, ref_timepoints)
+        cs._cache = self.cache
         self._sequences.append(cs)
 
     def insert(self, idx:int, ref_timepoints:DataChunk, ref_signals:DataChunk):
         cs = ContiguousRecord(len(ref_timepoints), ref_signals, ref_timepoints)
+        cs._cache = self.cache
         self._sequences.insert(idx, cs)
 
+    def enable_cache(self, max_bytes:int=2**30) -> ChunkCache:
+        """Enables a LRU cache of the arrays assembled by the sequences (see `ChunkCache`), shared by
+        all of them and by the Data_Pipe reading them. Its hit and miss counters are in `self.cache`.
+        Arrays returned from the cache are read-only, use `get(key, copy=True)` to modify them."""
+        self.cache = ChunkCache(max_bytes)
+        for seq in self._sequences:
+            seq._cache = self.cache
+        return self.cache
+
+    def disable_cache(self):
+        """Disables and empties the cache of the sequences"""
+        self.cache = None
+        for seq in self._sequences:
+            seq._cache = None
+
     def keys(self):
         keys = []
         for seq in self._sequences:
@@ -324,6 +888,21 @@ class RecordMaster(list):
 
         ax.set_xlim(-100,cursor)
 
+    def close(self):
+        """Close the files opened by a lazy import of this RecordMaster, or the shared memory blocks
+        attached by `attach_record`. Its LazyDataChunk, or its shared DataChunk, cannot be read anymore afterward."""
+        if any(not isinstance(file, h5py.File) for file in self._files): #Shared memory blocks
+            self._sequences = [] #Releases the views on the blocks before closing them
+        for file in self._files:
+            file.close()
+        self._files = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
     def to_s(self, n_frame):
         return round(self._frame_time*n_frame,2)
 
@@ -343,12 +922,110 @@ class RecordMaster(list):
         for seq in self._sequences:
             del seq
 
+# Cell
+def _merge_intervals(intervals:np.ndarray) -> np.ndarray:
+    """Sorts and merges the overlapping or adjacent intervals (array of shape (k,2) of [start, stop))"""
+    intervals = intervals[intervals[:,0] < intervals[:,1]]
+    if len(intervals) == 0:
+        return np.empty((0,2), dtype=int)
+    intervals    = intervals[np.argsort(intervals[:,0], kind="stable")]
+    new_interval = intervals[1:,0] > np.maximum.accumulate(intervals[:-1,1])
+    group_starts = np.concatenate(([0], np.where(new_interval)[0]+1))
+    return np.stack((intervals[group_starts,0], np.maximum.reduceat(intervals[:,1], group_starts)), axis=1)
+
+def _in_intervals(intervals:np.ndarray, points:np.ndarray) -> np.ndarray:
+    """Tells for each point if it falls in one of the sorted disjoint intervals"""
+    if len(intervals) == 0:
+        return np.zeros(len(points), dtype=bool)
+    idx = np.searchsorted(intervals[:,0], points, side="right") - 1
+    return (idx >= 0) & (points < intervals[np.maximum(idx, 0),1])
+
+def _interval_op(intervals_a:np.ndarray, intervals_b:np.ndarray, op:Callable) -> np.ndarray:
+    """Combines two sorted lists of disjoint intervals with the boolean operation op (like np.logical_and).
+    Only the boundaries of the intervals are evaluated, so the cost does not depend on their length."""
+    bounds = np.unique(np.concatenate((intervals_a.ravel(), intervals_b.ravel())))
+    if len(bounds) < 2:
+        return np.empty((0,2), dtype=int)
+    inside = op(_in_intervals(intervals_a, bounds[:-1]), _in_intervals(intervals_b, bounds[:-1]))
+    edges  = np.diff(np.concatenate(([0], inside.astype(int), [0])))
+    return np.stack((bounds[np.where(edges == 1)[0]], bounds[np.where(edges == -1)[0]]), axis=1)
+
+# Cell
+class _PrefetchIterator():
+    """Iterator over the segments of a Data_Pipe, assembling the next segments on a background thread
+    while the current one is processed. The thread stops when the iteration ends or `close` is called.
+    params:
+        - pipe: The Data_Pipe to iterate
+        - n: Number of segments prefetched, the depth of the queue"""
+    _END = object()
+
+    def __init__(self, pipe, n:int=2):
+        self.depth   = n
+        self._queue  = queue.Queue(maxsize=n)
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._prefetch, args=(pipe,), daemon=True)
+        self._thread.start()
+
+    def _put(self, item) -> bool:
+        while not self._closed.is_set():
+            try:
+                self._queue.put(item, timeout=.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _prefetch(self, pipe):
+        try:
+            for i in range(len(pipe)):
+                if not self._put((pipe[i], None)):
+                    return
+        except Exception as error:
+            self._put((None, error))
+        self._put((self._END, None))
+
+    def qsize(self) -> int:
+        """Number of segments ready in the queue"""
+        return self._queue.qsize()
+
+    def close(self):
+        """Stops the prefetching thread"""
+        self._closed.set()
+        self._thread.join()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._closed.is_set():
+            raise StopIteration
+        res, error = self._queue.get()
+        if error is not None:
+            self.close()
+            raise error
+        if res is self._END:
+            self.close()
+            raise StopIteration
+        return res
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
 # Cell
 class Data_Pipe():
     """
     A Data_Pipe is used to query data from a RecordMaster. By adding/substracting portions
     of the record using DataChunk names, it creates a mask over which specified DataChunks
     are retrivied as a dictionary from the Data_Pipe.
+    Retrieved arrays are views on the record data when they fall in a single DataChunk,
+    so copy them before any in-place modification.
+    Retrieval does not modify the RecordMaster, so that pipes can be iterated concurrently
+    (a pipe being its own iterator, use one per thread or index it with `pipe[i]`).
+    The mask of each sequence is kept as a sorted list of [start, stop) intervals, so that its
+    operations only depend on the number of DataChunk involved, not on the length of the record.
 
     params:
         - record_master: the RecordMaster from which to retrieve data
@@ -370,7 +1047,7 @@ class Data_Pipe():
 
         self.target_names = target_names
         self.data_names = data_names
-        self._masks     = [np.zeros(len(seq), dtype=bool) for seq in record_master]
+        self._masks     = [np.empty((0,2), dtype=int) for seq in record_master]
         self._slices    = []
 
     def plot(self, newfig=False):
@@ -386,7 +1063,7 @@ class Data_Pipe():
             factor = 1
         cursor = 0
         for i,seq in enumerate(self.record_master):
-            plt.plot(range(cursor,cursor+len(seq)), self._masks[i]*factor-1)
+            plt.plot(range(cursor,cursor+len(seq)), self.get_mask(i)*factor-1)
             cursor += len(seq) + self.record_master._sep_size
 
     def copy(self):
@@ -396,10 +1073,19 @@ class Data_Pipe():
         new_pipe =  Data_Pipe(record_master=self.record_master,
                          data_names=self.data_names,
                          target_names=self.target_names)
-        new_pipe._masks = np.copy(self._masks)
+        new_pipe._masks = [intervals.copy() for intervals in self._masks]
         new_pipe._slices = self._slices.copy()
         return new_pipe
 
+    def get_mask(self, seq_idx:int) -> np.ndarray:
+        """
+        Renders the mask of the sequence seq_idx as a boolean array.
+        """
+        mask = np.zeros(len(self.record_master[seq_idx]), dtype=bool)
+        for start, stop in self._masks[seq_idx]:
+            mask[start:stop] = True
+        return mask
+
     def _get_dchunk_names(self, names):
         if isinstance(names, str):
             names = [names]
@@ -416,18 +1102,31 @@ class Data_Pipe():
         for i, seq in enumerate(self.record_master):
             for name in self.data_names:
                 if name not in seq.keys():
-                    self._masks[i] = np.zeros(len(seq), dtype=bool)
+                    self._masks[i] = np.empty((0,2), dtype=int)
                     break
 
     def _update_slices(self):
         self._intersect_names() #Always intersect the names we wanna retrieve
         self._slices = []
         #Iterating the list of mask (one per seq of the record_master)
-        for j, mask in enumerate(self._masks):
-            seq = self.record_master[j]
-            mask = np.concatenate(([0],mask,[0])) #Putting zeros on the side in case the limits would be ones
-            for start, stop in np.where(mask[1:]-mask[:-1])[0].reshape(-1,2):#Split the mask where 0 separates the 1
-                self._slices.append((j, slice(start,stop)))
+        for j, intervals in enumerate(self._masks):
+            for start, stop in intervals:
+                self._slices.append((j, slice(int(start), int(stop))))
+
+    def _names_intervals(self, dchunk_name:list, seq:ContiguousRecord) -> np.ndarray:
+        """Merged intervals of the DataChunk of the given names in seq, clipped to the sequence"""
+        intervals = [np.stack((seq._starts[name], seq._stops[name]), axis=1)
+                     for name in dchunk_name if name in seq.keys()]
+        if len(intervals) == 0:
+            return np.empty((0,2), dtype=int)
+        return _merge_intervals(np.clip(np.concatenate(intervals), 0, len(seq)))
+
+    def _combine(self, names:Union[str, list], op:Callable):
+        dchunk_name = self._get_dchunk_names(names)
+        for i, seq in enumerate(self.record_master):
+            self._masks[i] = _interval_op(self._masks[i], self._names_intervals(dchunk_name, seq), op)
+        self._update_slices()
+        return self
 
     def __ior__(self, names:Union[str, list]):
         return self.__iadd__(names)
@@ -435,50 +1134,22 @@ class Data_Pipe():
         return self.copy().__ior__(names)
 
     def __iand__(self, names:Union[str, list]):
-        dchunk_name = self._get_dchunk_names(names)
-        for i, seq in enumerate(self.record_master):
-            new_mask = np.zeros(len(seq), dtype=bool)
-            for name in dchunk_name:
-                for slice_ in seq.get_slice(name):
-                    new_mask[slice_] = 1
-            self._masks[i] &= new_mask
-        self._update_slices()
-        return self
+        return self._combine(names, np.logical_and)
     def __and__(self, names:Union[str, list]):
         return self.copy().__iand__(names)
 
     def __ixor__(self, names:Union[str, list]):
-        dchunk_name = self._get_dchunk_names(names)
-        for i, seq in enumerate(self.record_master):
-            new_mask = np.zeros(len(seq), dtype=bool)
-            for name in dchunk_name:
-                for slice_ in seq.get_slice(name):
-                    new_mask[slice_] = 1
-            self._masks[i] ^= new_mask
-        self._update_slices()
-        return self
+        return self._combine(names, np.logical_xor)
     def __xor__(self, names:Union[str, list]):
         return self.copy().__ixor__(names)
 
     def __iadd__(self, names:Union[str, list]):
-        dchunk_name = self._get_dchunk_names(names)
-        for i, seq in enumerate(self.record_master):
-            for name in dchunk_name:
-                for slice_ in seq.get_slice(name):
-                    self._masks[i][slice_] = 1
-        self._update_slices()
-        return self
+        return self._combine(names, np.logical_or)
     def __add__(self, names:Union[str, list]):
         return self.copy().__iadd__(names)
 
     def __isub__(self, names:Union[str, list]):
-        dchunk_name = self._get_dchunk_names(names)
-        for i, seq in enumerate(self.record_master):
-            for name in dchunk_name:
-                for slice_ in seq.get_slice(name):
-                    self._masks[i][slice_] = 0
-        self._update_slices()
-        return self
+        return self._combine(names, lambda mask, new_mask: mask & ~new_mask)
     def __sub__(self, names:Union[str, list]):
         return self.copy().__isub__(names)
 
@@ -486,14 +1157,88 @@ class Data_Pipe():
         self._n = 0
         return self
 
+    def iter_prefetch(self, n:int=2) -> _PrefetchIterator:
+        """
+        Iterates the segments like `iter(pipe)`, while the next n segments are assembled on a
+        background thread, overlapping the reads of the record with the processing of the
+        current segment. The returned iterator exposes the queue depth (`depth`) and the number of
+        segments ready (`qsize()`). Call its `close` method, or use it as a context manager, when
+        leaving the iteration early.
+        """
+        return _PrefetchIterator(self, n)
+
+    def iter_windows(self, window:int, history:int=0, step:int=None):
+        """
+        Iterates the segments of the pipe by time windows of `window` bins, to stream through long
+        segments with bounded memory. Each window is preceded by `history` bins of left context,
+        read from the record even before the start of the segment, and filled with the filling value
+        before the start of the sequence. The last window of a segment can be shorter.
+        As for the segments, windows falling in a single DataChunk are views on the record data.
+
+        params:
+            - window: Number of bins of each window, without the history
+            - history: Number of bins of left context added to each window (like Hw for the STA)
+            - step: Number of bins between the start of two windows. Defaults to window
+        """
+        step = window if step is None else step
+        for seq_idx, seg_slice in self._slices:
+            seq = self.record_master[seq_idx]
+            for start in range(seg_slice.start, seg_slice.stop, step):
+                stop = min(start+window, seg_slice.stop)
+                res  = {}
+                for i, name in enumerate(self.data_names):
+                    res[self.target_names[i]] = self._read_window(seq, name, start-history, stop)
+                yield res
+
+    def stack(self, segments:slice=None, pad_value=None) -> Tuple[Dict[str, np.ndarray], np.ndarray]:
+        """
+        Retrieves the segments of the pipe stacked in a single array per target name, of shape
+        (n_segments, max_len, ...). Segments shorter than max_len are padded at their end with
+        pad_value, or with the filling value of their DataChunk if None. Each segment is written
+        directly in its row of the batch.
+
+        params:
+            - segments: Slice of the segments to stack. All segments are stacked if None
+            - pad_value: Value of the padding
+
+        return:
+            - Dictionary of the stacked arrays of each target name
+            - Lengths of the segments, from which a mask is obtained with `np.arange(max_len) < lengths[:,None]`
+        """
+        l_segments = self._slices if segments is None else self._slices[segments]
+        lengths    = np.array([_slice.stop-_slice.start for _, _slice in l_segments], dtype=int)
+        max_len    = lengths.max() if len(lengths) else 0
+        batch = {}
+        for name in self.data_names:
+            chunks = [dc for seq in self.record_master if name in seq.keys() for dc in seq._data_dict[name]]
+            if len(chunks) == 0: #No segment either, the pipe is empty
+                batch[name] = np.empty((len(l_segments), max_len))
+                continue
+            pad     = chunks[0].fill if pad_value is None else pad_value
+            batch[name] = np.full((len(l_segments), max_len, *chunks[0].shape[1:]), pad,
+                                  dtype=_common_dtype(chunks, pad))
+        for k, (seq_idx, _slice) in enumerate(l_segments):
+            out = {name: batch[name][k, :lengths[k]] for name in self.data_names}
+            self.record_master[seq_idx].gather(self.data_names, _slice, out=out)
+        return {self.target_names[i]: batch[name] for i, name in enumerate(self.data_names)}, lengths
+
+    @staticmethod
+    def _read_window(seq:ContiguousRecord, name:str, start:int, stop:int) -> DataChunk:
+        if start >= 0:
+            return seq.get(name, slice(start, stop))
+        datachunk = seq.get(name, slice(0, stop))
+        padding   = np.full((-start, *datachunk.shape[1:]), datachunk.fill, dtype=datachunk.dtype)
+        padded    = DataChunk(np.concatenate((padding, datachunk)), start, datachunk.group, datachunk.fill)
+        padded.attrs = datachunk.attrs
+        return padded
+
     def __next__(self):
         if self._n < len(self):
             res = {}
             seq_idx, _slice = self._slices[self._n]
-            self.record_master[seq_idx].set_slice(_slice)
+            data = self.record_master[seq_idx].gather(self.data_names, _slice)
             for i, name in enumerate(self.data_names):
-                res[self.target_names[i]] = self.record_master[seq_idx][name]
-            self.record_master[seq_idx].set_slice(None)
+                res[self.target_names[i]] = data[name]
             self._n += 1
             return res
         else:
@@ -505,19 +1250,21 @@ class Data_Pipe():
     def __getitem__(self, key):
         if isinstance(key, (int, np.integer)):
             seq_idx, _slice = self._slices[key]
-            self.record_master[seq_idx].set_slice(_slice)
-            res = {}
+            data = self.record_master[seq_idx].gather(self.data_names, _slice)
+            res  = {}
             for i, name in enumerate(self.data_names):
-                res[self.target_names[i]] = self.record_master[seq_idx][name]
-            self.record_master[seq_idx].set_slice(None)
+                res[self.target_names[i]] = data[name]
             return res
         elif isinstance(key, slice):
-            l_res = []
-            for seq_idx, _slice in self._slices[key]:
-                res = {}
+            segments = self._slices[key]
+            l_res    = [{} for _ in segments]
+            #The segments are sorted by sequence, so each sequence is read in one batch per name
+            for seq_idx, positions in itertools.groupby(range(len(segments)), key=lambda k: segments[k][0]):
+                positions = list(positions)
+                seq_slices = [segments[k][1] for k in positions]
                 for i, name in enumerate(self.data_names):
-                    res[self.target_names[i]] = self.record_master[seq_idx][name][_slice]
-                l_res.append(res)
+                    for k, datachunk in zip(positions, self.record_master[seq_idx].get_slices(name, seq_slices)):
+                        l_res[k][self.target_names[i]] = datachunk
             return l_res
         else:
             raise IndexError ("only integers and slices (`:`) are valid indices")
@@ -529,75 +1276,532 @@ class Data_Pipe():
         return "Pipe(%s)"%(repr(self.data_names)+", "+repr(self.target_names)+", "+repr(self._slices))
 
 # Cell
-def export_record(path, record_master):
+def _compress_chunk(data:np.ndarray, level:int, shuffle:bool) -> bytes:
+    """Encodes a chunk the way the HDF5 shuffle and gzip (deflate) filters would"""
+    raw = np.ascontiguousarray(data)
+    if shuffle and raw.dtype.itemsize > 1:
+        raw = raw.view(np.uint8).reshape(-1, raw.dtype.itemsize).T
+    return zlib.compress(raw.tobytes(), level)
+
+def _write_dataset(group, name:str, data:np.ndarray, compression, compression_opts, shuffle, chunk_len, executor):
+    """Creates the dataset name in group, with chunks covering chunk_len bins of the time axis.
+    With an executor and gzip compression, the chunks are compressed in parallel and written directly."""
+    if len(data) == 0 or (compression is None and chunk_len is None):
+        return group.create_dataset(name, data=data)
+    if chunk_len is None and executor is None:
+        return group.create_dataset(name, data=data, compression=compression,
+                                    compression_opts=compression_opts, shuffle=shuffle)
+    if chunk_len is None: #Aiming for chunks of ~1MB
+        row_bytes = max(1, data[:1].nbytes)
+        chunk_len = max(1, 2**20//row_bytes)
+    chunk_len = min(chunk_len, len(data))
+    dset = group.create_dataset(name, shape=data.shape, dtype=data.dtype, chunks=(chunk_len, *data.shape[1:]),
+                                compression=compression, compression_opts=compression_opts, shuffle=shuffle)
+    if executor is None or compression != "gzip" or data.dtype.kind not in "biuf":
+        dset[...] = data
+        return dset
+
+    def compress(start):
+        chunk = data[start:start+chunk_len]
+        if len(chunk) < chunk_len: #Edge chunks are stored full sized, in the byte order of the dataset
+            padded = np.zeros((chunk_len, *data.shape[1:]), dtype=data.dtype)
+            padded[:len(chunk)] = chunk
+            chunk = padded
+        return _compress_chunk(chunk, 4 if compression_opts is None else compression_opts, shuffle)
+
+    starts = range(0, len(data), chunk_len)
+    for start, compressed in zip(starts, executor.map(compress, starts)):
+        dset.id.write_direct_chunk((start, *[0]*(data.ndim-1)), compressed)
+    return dset
+
+def _chunk_arrays(datachunk, compact:bool=False) -> Tuple[str, Dict[str, np.ndarray], str]:
+    """Storage format and arrays to write for a DataChunk. With compact, the values are casted to
+    their `compact_dtype` and the original dtype is returned (None if unchanged)."""
+    if isinstance(datachunk, RLEDataChunk):
+        fmt, value_key = "rle", "values"
+        arrays = {"values": datachunk.values, "lengths": datachunk.lengths}
+    elif isinstance(datachunk, SparseDataChunk):
+        fmt, value_key = "csr", "data"
+        arrays = {"data": datachunk.matrix.data, "indices": datachunk.matrix.indices,
+                  "indptr": datachunk.matrix.indptr, "shape": np.array(datachunk.shape)}
+    else:
+        fmt, value_key = "dense", "data"
+        arrays = {"data": np.asarray(datachunk)}
+    orig_dtype = None
+    if compact:
+        values = arrays[value_key]
+        dtype  = compact_dtype(values)
+        if dtype != values.dtype:
+            arrays[value_key] = values.astype(dtype)
+            orig_dtype        = str(values.dtype)
+    return fmt, arrays, orig_dtype
+
+def _chunk_from_arrays(fmt:str, arrays:Dict[str, np.ndarray], idx:int, group:str, fill):
+    """Creates the DataChunk of the storage format fmt from its arrays, without copying them (inverse of _chunk_arrays)"""
+    if fmt == "rle":
+        return RLEDataChunk(values=arrays["values"], lengths=arrays["lengths"], idx=idx, group=group, fill=fill)
+    elif fmt == "csr":
+        matrix = sp_sparse.csr_matrix((arrays["data"], arrays["indices"], arrays["indptr"]),
+                                      shape=tuple(arrays["shape"]))
+        return SparseDataChunk(matrix, idx=idx, group=group, fill=fill)
+    return DataChunk(data=arrays["data"], idx=idx, group=group, fill=fill)
+
+def _data_hash(fmt:str, arrays:Dict[str, np.ndarray]) -> str:
+    """Content hash of the arrays of a DataChunk, used to detect unchanged DataChunk when updating a file"""
+    data_hash = hashlib.md5()
+    if fmt != "dense":
+        data_hash.update(fmt.encode())
+    for _, data in sorted(arrays.items()):
+        data_hash.update((str(data.dtype)+str(data.shape)).encode())
+        data_hash.update(np.ascontiguousarray(data).data)
+    return data_hash.hexdigest()
+
+def _write_chunk(group, name:str, fmt:str, arrays:Dict[str, np.ndarray], *write_args):
+    """Writes the arrays of a DataChunk under name, as a dataset for dense data or a group of datasets otherwise"""
+    if fmt == "dense":
+        return _write_dataset(group, name, arrays["data"], *write_args)
+    chunk_group = group.create_group(name)
+    if fmt == "csr": #The CSR arrays are not aligned on time, they are chunked by their own length
+        compression, compression_opts, shuffle, _, executor = write_args
+        write_args = (compression, compression_opts, shuffle, None, executor)
+    for array_name, data in arrays.items():
+        _write_dataset(chunk_group, array_name, data, *write_args)
+    return chunk_group
+
+def _write_stored_stimulus(stim_store, data_hash:str, fmt:str, arrays:Dict[str, np.ndarray], *write_args):
+    """Writes the arrays in the file data_hash.h5 of the stim_store directory, if not already present"""
+    store_path = os.path.join(stim_store, data_hash+".h5")
+    if os.path.exists(store_path):
+        return
+    tmp_path = "%s.%d.tmp" % (store_path, os.getpid()) #Renamed once complete, for concurrent exports
+    with h5py.File(tmp_path, mode="w") as store_f:
+        _write_chunk(store_f, "data", fmt, arrays, *write_args)
+    os.replace(tmp_path, store_path)
+
+def export_record(path, record_master, compression="gzip", compression_opts=4, shuffle=False,
+                  chunk_len:int=None, n_jobs:int=1, mode="w", stim_store=None, compact:bool=False):
     """Export a Record_Master object to an h5 file, readable outside of this library.
 
     params:
         - path: path of the file to be saved
         - record_master: RecordMaster to save
+        - compression: Compression filter of the datasets, one of ["gzip", "lzf", None]
+        - compression_opts: Compression level for gzip (0-9)
+        - shuffle: Apply the HDF5 shuffle filter before compression, improving the compression ratio
+        - chunk_len: Number of time bins in each HDF5 chunk. Small chunks makes the reading of short
+        time windows faster. Defaults to h5py automatic chunking, or chunks of ~1MB when n_jobs>1.
+        - n_jobs: Number of threads compressing the gzip chunks in parallel
+        - mode: "w" to write a new file, "a" to update an existing one. When updating, only the new
+        or modified DataChunk are written (detected by the content hash stored with each of them), their
+        attributes are refreshed, and the data absent of record_master is removed from the file.
+        HDF5 does not reclaim the space of removed data, use h5repack to shrink the file if needed.
+        The file must not be opened elsewhere, for example by a lazy import.
+        - stim_store: Directory of a content-addressed store for the stimuli. Each stimulus DataChunk
+        is written there once as <hash>.h5, and the record only keeps a reference to it with its
+        attributes. Records sharing a stimulus then share the same file.
+        - compact: If True, the values are written with their `compact_dtype` (lossless), like uint8 for
+        spike counts or int8 for binary checkerboards. `import_record` restores their original dtype.
     """
+    assert compression in ["gzip", "lzf", None], "compression must be one of ['gzip', 'lzf', None]"
+    assert mode in ["w", "a"], "mode must be one of ['w', 'a']"
+    if compression != "gzip":
+        compression_opts = None
     print("Exporting the record master")
-    with h5py.File(path, mode="w") as h5_f:
-        h5_f.attrs["_frame_time"] = record_master._frame_time
-        h5_f.attrs["_sep_size"]   = record_master._sep_size
-        for i, contig in enumerate(record_master):
-            #create contig
-            print("Contiguous sequence",i)
-            cntig_ref = h5_f.create_group(str(i))
-            cntig_ref.attrs["length"] = contig.length
-            for key, dc_list in contig._data_dict.items():
-                #create datastream
-                print("...Entering stream",key)
-                stream_ref = cntig_ref.create_group(key)
-                for datachunk in dc_list:
-                    print("......",str(datachunk.idx)+"->"+str(datachunk.idx+len(datachunk)))
-                    dset = stream_ref.create_dataset(str(datachunk.idx), data=np.array(datachunk), compression="gzip", compression_opts=4)
-                    for attr_k, attr_v in datachunk.attrs.items():
-                        dset.attrs[attr_k] = json.dumps(attr_v)
-                    dset.attrs["__fill"] = datachunk.fill
-                    dset.attrs["__group"] = datachunk.group
+    executor   = ThreadPoolExecutor(max_workers=n_jobs) if n_jobs > 1 else None
+    write_args = (compression, compression_opts, shuffle, chunk_len, executor)
+    if stim_store is not None:
+        os.makedirs(stim_store, exist_ok=True)
+    try:
+        with h5py.File(path, mode=mode) as h5_f:
+            h5_f.attrs["_frame_time"] = record_master._frame_time
+            h5_f.attrs["_sep_size"]   = record_master._sep_size
+            if stim_store is not None:
+                h5_f.attrs["_stim_store"] = os.path.relpath(stim_store, os.path.dirname(os.path.abspath(path)))
+            for i, contig in enumerate(record_master):
+                #create contig
+                print("Contiguous sequence",i)
+                cntig_ref = h5_f.require_group(str(i))
+                cntig_ref.attrs["length"] = contig.length
+                for key, dc_list in contig._data_dict.items():
+                    #create datastream
+                    print("...Entering stream",key)
+                    stream_ref = cntig_ref.require_group(key)
+                    for datachunk in dc_list:
+                        key_dc   = str(datachunk.idx)
+                        fmt, arrays, orig_dtype = _chunk_arrays(datachunk, compact)
+                        dc_hash  = _data_hash(fmt, arrays)
+                        in_store = stim_store is not None and datachunk.group == "stim"
+                        if (key_dc in stream_ref and stream_ref[key_dc].attrs.get("__hash") == dc_hash
+                                and ("__ref" in stream_ref[key_dc].attrs) == in_store):
+                            print("......",str(datachunk.idx)+"->"+str(datachunk.idx+len(datachunk)), "(unchanged)")
+                            dset = stream_ref[key_dc]
+                            for attr_k in list(dset.attrs.keys()):
+                                del dset.attrs[attr_k]
+                        else:
+                            print("......",str(datachunk.idx)+"->"+str(datachunk.idx+len(datachunk)))
+                            if key_dc in stream_ref:
+                                del stream_ref[key_dc]
+                            if in_store:
+                                _write_stored_stimulus(stim_store, dc_hash, fmt, arrays, *write_args)
+                                dset = stream_ref.create_dataset(key_dc, shape=(0,), dtype=datachunk.dtype)
+                            else:
+                                dset = _write_chunk(stream_ref, key_dc, fmt, arrays, *write_args)
+                        for attr_k, attr_v in datachunk.attrs.items():
+                            dset.attrs[attr_k] = json.dumps(attr_v)
+                        dset.attrs["__fill"] = datachunk.fill
+                        dset.attrs["__group"] = datachunk.group
+                        dset.attrs["__hash"] = dc_hash
+                        if in_store:
+                            dset.attrs["__ref"] = dc_hash
+                        if fmt != "dense":
+                            dset.attrs["__format"] = fmt
+                        if orig_dtype is not None:
+                            dset.attrs["__dtype"] = orig_dtype
+                    for key_dc in set(stream_ref.keys()) - set(str(dc.idx) for dc in dc_list):
+                        del stream_ref[key_dc]
+                for key in set(cntig_ref.keys()) - set(contig.keys()):
+                    del cntig_ref[key]
+            for key_contig in set(h5_f.keys()) - set(str(i) for i in range(len(record_master))):
+                del h5_f[key_contig]
+    finally:
+        if executor is not None:
+            executor.shutdown()
     print()
 
-def import_record(path):
-    """Import a Record_Master from an h5 file saved by the export_record function of this library.
+# Cell
+def _add_sequence(record_master, stream_d:Dict[str, list], frame_time:float=None) -> RecordMaster:
+    """Appends to record_master the sequence of the DataChunk lists in stream_d, and returns it. A new
+    RecordMaster is created if record_master is None."""
+    if record_master is None:
+        frame_rate    = 60 if frame_time is None else 1/frame_time
+        record_master = RecordMaster([(stream_d["main_tp"][0],stream_d["signals"][0])], frame_rate=frame_rate)
+    else:
+        record_master.append(stream_d["main_tp"][0],stream_d["signals"][0])
+    for kstream, vstream in stream_d.items():
+        for k, dc in enumerate(vstream):
+            if kstream in ["main_tp", "signals"] and k==0:
+                continue
+            record_master.set_datachunk(dc, name=kstream, sequence_idx=len(record_master)-1)
+    return record_master
+
+def _read_datachunk(dset, idx:int, lazy:bool=False, open_ref:Callable=None):
+    """Creates the DataChunk, or LazyDataChunk if lazy, of an h5 dataset (or group for the
+    non-dense formats) written by export_record. References to a stored stimulus are resolved with open_ref."""
+    attrs, fmt, ref, dtype = {}, "dense", None, None
+    for k,v in dset.attrs.items():
+        if k == "__fill":
+            fill = v
+        elif k == "__group":
+            group = v
+        elif k == "__format":
+            fmt = v
+        elif k == "__ref":
+            ref = v
+        elif k == "__dtype":
+            dtype = v
+        elif k != "__hash":
+            attrs[k] = json.loads(v)
+    if ref is not None:
+        dset = open_ref(ref)
+    if fmt != "dense":
+        arrays    = {k: dset[k][:] for k in dset.keys()}
+        value_key = "values" if fmt == "rle" else "data"
+        arrays[value_key] = arrays[value_key].astype(dtype or arrays[value_key].dtype, copy=False)
+        dchunk = _chunk_from_arrays(fmt, arrays, idx=idx, group=group, fill=fill)
+    elif lazy:
+        dchunk = LazyDataChunk(dataset=dset, idx=idx, group=group, fill=fill, dtype=dtype)
+    else:
+        dchunk = DataChunk(data=dset[:].astype(dtype or dset.dtype, copy=False), idx=idx, group=group, fill=fill)
+    dchunk.attrs = attrs
+    return dchunk
+
+def _stream_selected(name:str, group:str, names, groups, exclude_names, exclude_groups) -> bool:
+    """Tells if a stream passes the include/exclude filters of import_record"""
+    if name in [ContiguousRecord.MAIN_TP, ContiguousRecord.SIGNALS]:
+        return True #Always needed to build the sequences
+    if name in exclude_names or group in exclude_groups:
+        return False
+    if names is None and groups is None:
+        return True
+    return name in (names or []) or group in (groups or [])
+
+# Cell
+_MANIFEST = "manifest.json" #Description of the DataChunk of a directory written by export_record_dir
+
+def export_record_dir(path, record_master):
+    """Export a RecordMaster to a directory, with one uncompressed .npy file per array of each DataChunk
+    and a JSON manifest of their idx, group, fill and attributes. With `lazy=True`, `import_record` opens it
+    by memory-mapping the files: the import is instant and time slices are read at the speed of the page
+    cache, which suits scratch copies read by repeated analyses. The .npy files listed in the manifest of a
+    previous export to path that are not part of this one are removed, other files are left untouched.
+
+    params:
+        - path: path of the directory to write
+        - record_master: RecordMaster to save
+    """
+    print("Exporting the record master")
+    os.makedirs(path, exist_ok=True)
+    previous = set()
+    if os.path.isfile(os.path.join(path, _MANIFEST)):
+        with open(os.path.join(path, _MANIFEST)) as f:
+            for sequence in json.load(f)["sequences"]:
+                for stream in sequence["streams"].values():
+                    for desc in stream:
+                        previous.update(desc["files"].values())
+    manifest = {"_frame_time": record_master._frame_time, "_sep_size": record_master._sep_size, "sequences": []}
+    written  = set()
+    for i, contig in enumerate(record_master):
+        print("Contiguous sequence",i)
+        streams = {}
+        for key, dc_list in contig._data_dict.items():
+            print("...Entering stream",key)
+            os.makedirs(os.path.join(path, str(i), key), exist_ok=True)
+            streams[key] = []
+            for datachunk in dc_list:
+                print("......",str(datachunk.idx)+"->"+str(datachunk.idx+len(datachunk)))
+                fmt, arrays, _ = _chunk_arrays(datachunk)
+                files = {}
+                for array_key, array in arrays.items():
+                    suffix = "" if fmt == "dense" else "."+array_key
+                    files[array_key] = "/".join([str(i), key, str(datachunk.idx)+suffix+".npy"])
+                    np.save(os.path.join(path, files[array_key]), array)
+                written.update(files.values())
+                fill = datachunk.fill.item() if isinstance(datachunk.fill, np.generic) else datachunk.fill
+                streams[key].append({"idx": int(datachunk.idx), "group": datachunk.group, "fill": fill,
+                                     "format": fmt, "files": files, "attrs": datachunk.attrs})
+        manifest["sequences"].append({"length": contig.length, "streams": streams})
+    with open(os.path.join(path, _MANIFEST), "w") as f:
+        json.dump(manifest, f)
+    for rel_path in previous - written:
+        if os.path.isfile(os.path.join(path, *rel_path.split("/"))):
+            os.remove(os.path.join(path, *rel_path.split("/")))
+    print()
+
+def _import_record_dir(path, lazy, names, groups, sequences, exclude_names, exclude_groups):
+    """Import a RecordMaster from a directory written by export_record_dir (see import_record)"""
+    with open(os.path.join(path, _MANIFEST)) as f:
+        manifest = json.load(f)
+    mmap_mode     = "r" if lazy else None
+    record_master = None
+    for j, sequence in enumerate(manifest["sequences"]):
+        if sequences is not None and j not in sequences:
+            continue
+        stream_d = {}
+        for key_dstream, descs in sequence["streams"].items():
+            if not _stream_selected(key_dstream, descs[0]["group"], names, groups, exclude_names, exclude_groups):
+                continue
+            dchunk_l = []
+            for desc in descs:
+                arrays = {k: np.load(os.path.join(path, file), mmap_mode=mmap_mode) for k, file in desc["files"].items()}
+                dchunk = _chunk_from_arrays(desc["format"], arrays, idx=desc["idx"], group=desc["group"], fill=desc["fill"])
+                dchunk.attrs = desc["attrs"]
+                dchunk_l.append(dchunk)
+            stream_d[key_dstream] = dchunk_l
+        record_master = _add_sequence(record_master, stream_d, manifest["_frame_time"])
+    if record_master is None:
+        raise ValueError("None of the sequences %s is in the directory" % sequences)
+    record_master._sep_size = manifest["_sep_size"]
+    return record_master
+
+# Cell
+def import_record(path, lazy=False, names:Union[str,list]=None, groups:Union[str,list]=None,
+                  sequences:Union[int,list]=None, exclude_names:Union[str,list]=None, exclude_groups:Union[str,list]=None,
+                  stim_store=None):
+    """Import a Record_Master from an h5 file saved by the export_record function of this library,
+    or from a directory saved by export_record_dir. The streams to import can be filtered by names,
+    groups and sequences, the others are not read from the file. "main_tp" and "signals" are always imported.
 
     params:
         - path: path of the RecordMaster to import
+        - lazy: If True, the data is not read but imported as LazyDataChunk, that read from the file
+        only the rows that are queried. The file then stays open until the RecordMaster is closed,
+        with `record_master.close()` or by using it as a context manager. RLE and sparse DataChunk are
+        always read, in their compact form. For a directory, the .npy files are memory-mapped read-only.
+        - names: Name, or list of names of the streams to import. With groups, the streams matching
+        either a name or a group are imported. All streams are imported if both are None.
+        - groups: Group, or list of groups in {stim, sync, cell, data} of the streams to import.
+        - sequences: Index, or list of indexes of the contiguous sequences to import, in their order of the file.
+        - exclude_names: Name, or list of names of the streams not to import.
+        - exclude_groups: Group, or list of groups of the streams not to import.
+        - stim_store: Directory of the stimulus store used by export_record. Defaults to the directory
+        recorded in the file. Only the stored stimuli referenced by the imported streams are opened.
+
+    return:
+        - The imported RecordMaster
     """
+    if isinstance(names, str):
+        names = [names]
+    if isinstance(groups, str):
+        groups = [groups]
+    if isinstance(sequences, (int, np.integer)):
+        sequences = [sequences]
+    if isinstance(exclude_names, str):
+        exclude_names = [exclude_names]
+    if isinstance(exclude_groups, str):
+        exclude_groups = [exclude_groups]
+    exclude_names  = exclude_names or []
+    exclude_groups = exclude_groups or []
+
     print("Importing the record master")
-    with h5py.File(path, mode="r") as h5_f:
+    if os.path.isdir(path):
+        return _import_record_dir(path, lazy, names, groups, sequences, exclude_names, exclude_groups)
+    h5_f = h5py.File(path, mode="r")
+    if stim_store is None and "_stim_store" in h5_f.attrs:
+        stim_store = os.path.join(os.path.dirname(os.path.abspath(path)), h5_f.attrs["_stim_store"])
+    store_files = {}
+    def open_ref(ref):
+        if ref not in store_files:
+            store_files[ref] = h5py.File(os.path.join(stim_store, ref+".h5"), mode="r")
+        return store_files[ref]["data"]
+
+    try:
         record_master = None
-        for j, key_contig in enumerate(h5_f.keys()):
+        for j, key_contig in enumerate(sorted(h5_f.keys(), key=int)):
+            if sequences is not None and j not in sequences:
+                continue
             ref_contig = h5_f[key_contig]
             stream_d = {}
             for i, key_dstream in enumerate(ref_contig.keys()):
                 ref_dstream = ref_contig[key_dstream]
+                keys_dc     = list(ref_dstream.keys())
+                group       = ref_dstream[keys_dc[0]].attrs["__group"]
+                if not _stream_selected(key_dstream, group, names, groups, exclude_names, exclude_groups):
+                    continue
                 dchunk_l = []
-                for key_dc in ref_dstream.keys():
-
-                    data = ref_dstream[key_dc]
-                    idx  = int(key_dc)
-                    attrs = {}
-                    for k,v in data.attrs.items():
-                        if k not in  ["__fill", "__group"]:
-                            attrs[k] = json.loads(v)
-                        elif k == "__fill":
-                            fill = v
-                        elif k == "__group":
-                            group = v
-                    dchunk = DataChunk(data=data[:], idx=idx, group=group)
-                    dchunk.attrs = attrs
-                    dchunk_l.append(dchunk)
+                for key_dc in keys_dc:
+                    dchunk_l.append(_read_datachunk(ref_dstream[key_dc], idx=int(key_dc), lazy=lazy, open_ref=open_ref))
 
                 stream_d[key_dstream] = dchunk_l
-            if record_master is None:
-                record_master = RecordMaster([(stream_d["main_tp"][0],stream_d["signals"][0])])
-            else:
-                record_master.append(stream_d["main_tp"][0],stream_d["signals"][0])
-            for kstream, vstream in stream_d.items():
-                for k, dc in enumerate(vstream):
-                    if kstream in ["main_tp", "signals"] and k==0:
-                        continue
-                    record_master.set_datachunk(dc, name=kstream, sequence_idx=j)
+            record_master = _add_sequence(record_master, stream_d)
+        if record_master is None:
+            raise ValueError("None of the sequences %s is in the file" % sequences)
+    except:
+        for file in [h5_f, *store_files.values()]:
+            file.close()
+        raise
+    if lazy:
+        record_master._files.extend([h5_f, *store_files.values()])
+    else:
+        for file in [h5_f, *store_files.values()]:
+            file.close()
     print()
+    return record_master
+
+# Cell
+def _share_array(array:np.ndarray, blocks:list) -> dict:
+    """Copies array in a new shared memory block appended to blocks, and returns the description to attach it"""
+    array = np.asarray(array)
+    if array.dtype.hasobject:
+        raise TypeError("Arrays of python objects cannot be placed in shared memory")
+    from multiprocessing import shared_memory #Python 3.8+, only needed to share records
+    block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    blocks.append(block)
+    np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+    return {"name": block.name, "shape": array.shape, "dtype": array.dtype}
+
+_untrack_attached = None #Whether this process unregisters the blocks it attaches from its resource tracker
+
+def _attach_array(desc:dict, blocks:list) -> np.ndarray:
+    """Read-only view of the shared memory block described by desc. The block is appended to blocks"""
+    global _untrack_attached
+    from multiprocessing import shared_memory, resource_tracker
+    #A worker started before the blocks were created runs its own resource tracker, which would unlink
+    #them when the worker exits. They must only be tracked by the process owning the SharedRecord.
+    if sys.version_info >= (3, 13):
+        block = shared_memory.SharedMemory(name=desc["name"], track=False)
+    else:
+        if _untrack_attached is None:
+            #Relies on the private `_fd` of the resource tracker, unset until it is started. Checked against
+            #CPython 3.8 to 3.12, the versions having shared_memory without the track argument.
+            _untrack_attached = getattr(resource_tracker._resource_tracker, "_fd", None) is None
+        block = shared_memory.SharedMemory(name=desc["name"])
+        if _untrack_attached:
+            resource_tracker.unregister(block._name, "shared_memory")
+    blocks.append(block)
+    array = np.ndarray(desc["shape"], dtype=desc["dtype"], buffer=block.buf)
+    array.flags.writeable = False
+    return array
+
+class SharedRecord():
+    """
+    Copy of a RecordMaster placed in shared memory (`multiprocessing.shared_memory`), for
+    multiprocessing workers to read it without each receiving a pickled copy.
+
+    The arrays of each DataChunk (values and lengths of RLEDataChunk, CSR arrays of
+    SparseDataChunk) are copied once in shared memory blocks. `self.spec` describes the blocks
+    with the metadata of the DataChunk (idx, group, fill and attrs): it is small and picklable,
+    and is sent to the workers that rebuild the RecordMaster with `attach_record(spec)`,
+    as read-only views of the blocks.
+
+    The SharedRecord owns the blocks: keep it alive while the workers run, and free the blocks
+    with `close()` or by using it as a context manager. The workers must be started by multiprocessing
+    from this process. Requires python 3.8 or later, for `multiprocessing.shared_memory`.
+
+    params:
+        - record_master: RecordMaster to share. Its LazyDataChunk are read.
+    """
+
+    def __init__(self, record_master:RecordMaster):
+        self._blocks = []
+        try:
+            sequences = []
+            for contig in record_master:
+                sequences.append({key: [self._share_chunk(dc) for dc in dc_list]
+                                  for key, dc_list in contig._data_dict.items()})
+        except:
+            self.close()
+            raise
+        self.spec = {"frame_time": record_master._frame_time, "sequences": sequences}
+
+    def _share_chunk(self, datachunk) -> dict:
+        fmt, arrays, _ = _chunk_arrays(datachunk)
+        return {"format": fmt, "idx": datachunk.idx, "group": datachunk.group, "fill": datachunk.fill,
+                "attrs": dict(datachunk.attrs),
+                "arrays": {k: _share_array(array, self._blocks) for k, array in arrays.items()}}
+
+    @property
+    def nbytes(self):
+        return sum(block.size for block in self._blocks)
+
+    def close(self):
+        """Frees the shared memory blocks. The RecordMaster attached by the workers cannot be read anymore afterward."""
+        for block in self._blocks:
+            block.close()
+            block.unlink()
+        self._blocks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __repr__(self):
+        return "SharedRecord(%d sequences, %d blocks, %.1f MB)" % (len(self.spec["sequences"]), len(self._blocks),
+                                                                   self.nbytes/2**20)
+
+# Cell
+def attach_record(spec:dict) -> RecordMaster:
+    """Rebuilds the RecordMaster shared by a SharedRecord from its `spec`, typically in a worker process.
+    Its DataChunk are read-only views of the shared memory blocks, without copy. The blocks stay attached
+    until `record_master.close()`, which requires the arrays obtained from the record to be released.
+
+    params:
+        - spec: The `spec` attribute of the SharedRecord
+
+    return:
+        - The attached RecordMaster
+    """
+    blocks = []
+    def attach_chunk(desc):
+        arrays = {k: _attach_array(array_desc, blocks) for k, array_desc in desc["arrays"].items()}
+        dchunk = _chunk_from_arrays(desc["format"], arrays, idx=desc["idx"], group=desc["group"], fill=desc["fill"])
+        dchunk.attrs = dict(desc["attrs"])
+        return dchunk
+
+    record_master = None
+    for streams in spec["sequences"]:
+        stream_d = {key: [attach_chunk(desc) for desc in descs] for key, descs in streams.items()}
+        record_master = _add_sequence(record_master, stream_d, spec["frame_time"])
+    record_master._files.extend(blocks)
     return record_master
\ No newline at end of file
@@ -377,6 +377,7 @@ def plot_chirp(stim_inten, spike_bins, smooth=True, ax=None):
     """
     if ax is None:
         fig, ax = plt.subplots()
+    stim_inten = np.asarray(stim_inten)
     #Getting the number of repeats by convolving a part of the stimulus
     conv_res  = np.convolve(stim_inten[360:600].astype(float), stim_inten.astype(float), mode="full")
     n_repeats = np.sum(conv_res.max()==conv_res)
@@ -478,6 +479,18 @@ def plot_spike_template_MEA(cluster_composition, templates, channel_positions, a
 
     return ax
 
+def _cluster_spikes(spike_clusters, cluster) -> np.ndarray:
+    """Indexes of the spikes of cluster, from the phy spike_clusters array or its ClusterIndex"""
+    if isinstance(spike_clusters, ClusterIndex):
+        return spike_clusters.spikes(cluster)
+    return np.flatnonzero(spike_clusters==cluster)
+
+def _phy_cluster_index(phy_dict) -> ClusterIndex:
+    """ClusterIndex of the phy results, either a PhyResults or a plain dictionnary of the phy arrays"""
+    if isinstance(phy_dict, PhyResults):
+        return phy_dict.cluster_index
+    return build_cluster_index(phy_dict["spike_clusters"])
+
 def plot_autocorrelogram(cluster, spike_times, spike_clusters, bin_ms=.001, sampling_rate=30000, tails=30, ax=None):
     """
     Plot the cell's response autocorrelogram
@@ -485,7 +498,7 @@ def plot_autocorrelogram(cluster, spike_times, spike_clusters, bin_ms=.001, samp
     params:
         - cluster: Cluster id of the cell
         - spike_times: Times of all spikes in phy format
-        - spike_clusters: cluster associated to the spikes in phy format
+        - spike_clusters: cluster associated to the spikes in phy format, or their ClusterIndex
         - bin_ms: Size of the autocorrelogram bin in ms
         - sampling_rate: Sampling rate of the electrophysiology
         - tails: Size of the tails for the autocorrelogram
@@ -498,8 +511,7 @@ def plot_autocorrelogram(cluster, spike_times, spike_clusters, bin_ms=.001, samp
     if ax is None:
         fig, ax = plt.subplots()
 
-    cluster_mask = spike_clusters==cluster
-    cluster_times = spike_times[cluster_mask]
+    cluster_times = spike_times[_cluster_spikes(spike_clusters, cluster)]
     hist = np.histogram(cluster_times, bins=np.linspace(0,cluster_times[-1], int(cluster_times[-1]/(bin_ms*sampling_rate))))[0]
     hist_tails = np.concatenate(([0]*tails, hist, [0]*tails))
     corr = np.correlate(hist_tails, hist, mode="valid")
@@ -518,7 +530,7 @@ def plot_spike_amplitudes(cluster, spike_templates, spike_clusters, spike_times,
         - cluster: Cluster id of the cell
         - spike_templates: Original templates id in phy format
         - spike_times: Times of all spikes in phy format
-        - spike_clusters: cluster associated to the spikes in phy format
+        - spike_clusters: cluster associated to the spikes in phy format, or their ClusterIndex
         - amplitudes: Spike amplitudes in phy format
         - n_max_dots: Max limit for the number of spikes to not overload the plot
         - ax: The axis for the plot. If None, a new plot is created
@@ -530,17 +542,17 @@ def plot_spike_amplitudes(cluster, spike_templates, spike_clusters, spike_times,
     if ax is None:
         fig, ax = plt.subplots()
 
-    mask_cluster = spike_clusters==cluster
-    clusters = np.unique(spike_templates[mask_cluster])
-    points_per_cluster = n_max_dots//len(clusters)
-    total_spikes = np.sum(mask_cluster)
+    cluster_spikes    = _cluster_spikes(spike_clusters, cluster)
+    cluster_templates = spike_templates[cluster_spikes]
+    clusters = np.unique(cluster_templates)
+    total_spikes = len(cluster_spikes)
     for templ in clusters:
-        mask_template    = spike_templates==templ
-        n_spike_template = np.sum(mask_template)
+        templ_spikes     = cluster_spikes[cluster_templates==templ]
+        n_spike_template = len(templ_spikes)
         proportion       = n_spike_template/total_spikes
         n_sp_to_plot     = int(n_max_dots*proportion)
-        mask_selected_spikes = np.linspace(0, n_spike_template, n_sp_to_plot, dtype=int, endpoint=False)
-        ax.scatter(spike_times[mask_template][mask_selected_spikes], amplitudes[mask_template][mask_selected_spikes], s=1)
+        selected_spikes  = templ_spikes[np.linspace(0, n_spike_template, n_sp_to_plot, dtype=int, endpoint=False)]
+        ax.scatter(spike_times[selected_spikes], amplitudes[selected_spikes], s=1)
 
     ax.set_xticks([])
     ax.set_title("Spike amplitudes - n°spike: "+str(total_spikes))
@@ -933,6 +945,7 @@ def plot_recap_vivo_ephy(title_dict, reM, phy_dict, cluster_ids, df_stim, cell_d
     if cell_db_ids is None:
         cell_db_ids = [-1]*len(cluster_ids)
 
+    cluster_index = _phy_cluster_index(phy_dict)
     with PdfPages(export_path) as pp:
 
         #Plotting Cover
@@ -957,8 +970,8 @@ def plot_recap_vivo_ephy(title_dict, reM, phy_dict, cluster_ids, df_stim, cell_d
                                    "Cluster n°"+str(cluster), "Cell id n°"+str(cell_id)])
             plt.suptitle(suptitle)
 
-            mask_cluster = phy_dict["spike_clusters"]==cluster
-            cluster_composition = np.unique(phy_dict["spike_templates"][mask_cluster])
+            cluster_spikes = cluster_index.spikes(cluster)
+            cluster_composition = np.unique(phy_dict["spike_templates"][cluster_spikes])
 
             gs = gridspec.GridSpec(28, 20, left=0.05, right=.95, top=.92, bottom=.05, wspace=0.00, hspace=0.00)
 
@@ -968,12 +981,12 @@ def plot_recap_vivo_ephy(title_dict, reM, phy_dict, cluster_ids, df_stim, cell_d
 
             #Autocorrelogram
             autocorr_ax = fig.add_subplot(gs[0:4,3:7])
-            plot_autocorrelogram(cluster, phy_dict["spike_times"], phy_dict["spike_clusters"],
+            plot_autocorrelogram(cluster, phy_dict["spike_times"], cluster_index,
                                  bin_ms=.001, sampling_rate=30000, tails=30, ax=autocorr_ax)
 
             #Spike amplitude across time
             sp_amp_ax = fig.add_subplot(gs[0:4,8:])
-            plot_spike_amplitudes(cluster, phy_dict["spike_templates"], phy_dict["spike_clusters"],
+            plot_spike_amplitudes(cluster, phy_dict["spike_templates"], cluster_index,
                                   phy_dict["spike_times"], phy_dict["amplitudes"], ax=sp_amp_ax)
             plot_stim_epochs_to_ephy(reM, y_pos=-0.05, ax=sp_amp_ax)
 
@@ -1215,6 +1228,7 @@ def plot_recap_vitro_ephy(title_dict, reM, phy_dict, cluster_ids, df_stim, cell_
     if cell_db_ids is None:
         cell_db_ids = [-1]*len(cluster_ids)
 
+    cluster_index = _phy_cluster_index(phy_dict)
     with PdfPages(export_path) as pp:
 
         #Plotting Cover
@@ -1239,8 +1253,8 @@ def plot_recap_vitro_ephy(title_dict, reM, phy_dict, cluster_ids, df_stim, cell_
                                    "Cluster n°"+str(cluster), "Cell id n°"+str(cell_id)])
             plt.suptitle(suptitle)
 
-            mask_cluster = phy_dict["spike_clusters"]==cluster
-            cluster_composition = np.unique(phy_dict["spike_templates"][mask_cluster])
+            cluster_spikes = cluster_index.spikes(cluster)
+            cluster_composition = np.unique(phy_dict["spike_templates"][cluster_spikes])
 
             gs = gridspec.GridSpec(28, 20, left=0.05, right=.95, top=.92, bottom=.05, wspace=0.00, hspace=0.00)
 
@@ -1250,12 +1264,12 @@ def plot_recap_vitro_ephy(title_dict, reM, phy_dict, cluster_ids, df_stim, cell_
 
             #Autocorrelogram
             autocorr_ax = fig.add_subplot(gs[0:4,5:9])
-            plot_autocorrelogram(cluster, phy_dict["spike_times"], phy_dict["spike_clusters"],
+            plot_autocorrelogram(cluster, phy_dict["spike_times"], cluster_index,
                                  bin_ms=.001, sampling_rate=30000, tails=30, ax=autocorr_ax)
 
             #Spike amplitude across time
             sp_amp_ax = fig.add_subplot(gs[0:4,10:])
-            plot_spike_amplitudes(cluster, phy_dict["spike_templates"], phy_dict["spike_clusters"],
+            plot_spike_amplitudes(cluster, phy_dict["spike_templates"], cluster_index,
                                   phy_dict["spike_times"], phy_dict["amplitudes"], ax=sp_amp_ax)
             plot_stim_epochs_to_ephy(reM, y_pos=0.2, ax=sp_amp_ax)
 
@@ -1342,6 +1356,7 @@ def plot_recap_vivo_ephy_dome(title_dict, reM, phy_dict, cluster_ids, cell_db_id
     if cell_db_ids is None:
         cell_db_ids = [-1]*len(cluster_ids)
 
+    cluster_index = _phy_cluster_index(phy_dict)
     with PdfPages(export_path) as pp:
 
         #Plotting Cover
@@ -1364,8 +1379,8 @@ def plot_recap_vivo_ephy_dome(title_dict, reM, phy_dict, cluster_ids, cell_db_id
                                    "Cluster n°"+str(cluster), "Cell id n°"+str(cell_id)])
             plt.suptitle(suptitle)
 
-            mask_cluster = phy_dict["spike_clusters"]==cluster
-            cluster_composition = np.unique(phy_dict["spike_templates"][mask_cluster])
+            cluster_spikes = cluster_index.spikes(cluster)
+            cluster_composition = np.unique(phy_dict["spike_templates"][cluster_spikes])
 
             gs = gridspec.GridSpec(28, 20, left=0.05, right=.95, top=.92, bottom=.05, wspace=0.00, hspace=0.00)
 
@@ -1375,12 +1390,12 @@ def plot_recap_vivo_ephy_dome(title_dict, reM, phy_dict, cluster_ids, cell_db_id
 
             #Autocorrelogram
             autocorr_ax = fig.add_subplot(gs[0:4,3:7])
-            plot_autocorrelogram(cluster, phy_dict["spike_times"], phy_dict["spike_clusters"],
+            plot_autocorrelogram(cluster, phy_dict["spike_times"], cluster_index,
                                  bin_ms=.001, sampling_rate=30000, tails=30, ax=autocorr_ax)
 
             #Spike amplitude across time
             sp_amp_ax = fig.add_subplot(gs[0:4,8:])
-            plot_spike_amplitudes(cluster, phy_dict["spike_templates"], phy_dict["spike_clusters"],
+            plot_spike_amplitudes(cluster, phy_dict["spike_templates"], cluster_index,
                                   phy_dict["spike_times"], phy_dict["amplitudes"], ax=sp_amp_ax)
             plot_stim_epochs_to_ephy(reM, y_pos=0.2, ax=sp_amp_ax)
 
@@ -1,9 +1,10 @@
 # AUTOGENERATED! DO NOT EDIT! File to edit: 02_processing.ipynb (unless otherwise specified).
 
 __all__ = ['eyetrack_stim_inten', 'saccade_distances', 'smooth_eye_position', 'process_sta_batch', 'staEst_fromBins',
-           'process_sta_batch_large', 'cross_correlation', 'corrcoef', 'flatten_corrcoef', 'stimulus_ensemble',
-           'process_nonlinearity', 'activity_histogram', 'cross_distances', 'cross_distances_sta', 'paired_distances',
-           'paired_distances_sta', 'direction_selectivity', 'peri_saccadic_response']
+           'staEst_fromRuns', 'staEst_fromSparse', 'process_sta_batch_large', 'cross_correlation', 'corrcoef',
+           'flatten_corrcoef', 'stimulus_ensemble', 'process_nonlinearity', 'activity_histogram', 'cross_distances',
+           'cross_distances_sta', 'paired_distances', 'paired_distances_sta', 'direction_selectivity',
+           'peri_saccadic_response']
 
 # Cell
 from functools import partial
@@ -13,6 +14,7 @@ from sklearn import cluster
 import scipy.ndimage as ndimage
 import scipy.signal as signal
 import scipy as sp
+import scipy.sparse as sp_sparse
 from cmath import *
 import itertools
 import random
@@ -43,6 +45,8 @@ def eyetrack_stim_inten(stim_inten, eye_track,
     return:
         - Upsampled and shift corrected stimulus intensity
     """
+    if isinstance(stim_inten, RLEDataChunk): #Each frame is shifted differently, the runs are lost
+        stim_inten = np.asarray(stim_inten)
     eye_x, eye_y = eye_track[:,0], eye_track[:,1]
     shape_y, shape_x = 1, 1
     if len(stim_inten.shape)==2:
@@ -205,18 +209,34 @@ def process_sta_batch(stim_inten, spike_counts, Hw=30, Fw=2, return_pval=False,
     return:
         - stas of shape (n_cell, Hw+Fw, ...)
         - stas and pvalues if return_pval=True, both of shape (n_cell, Hw+Fw, ...)
+
+    A stim_inten given as a RLEDataChunk is used without expanding its frames (see `staEst_fromRuns`), and
+    spike_counts given as a SparseDataChunk or scipy.sparse matrix without densifying it (see `staEst_fromSparse`).
     """
     assert normalisation in ["abs", "L2", None], "normalisation must be one of ['abs', 'L2', None]"
     #Preparing the stimulus
     orig_shape = stim_inten.shape
     stim_inten = stim_inten_norm(stim_inten)
-    sum_spikes = np.sum(spike_counts, axis=0)
+    if isinstance(spike_counts, SparseDataChunk):
+        spike_counts = spike_counts.matrix
+    if sp_sparse.issparse(spike_counts) and isinstance(stim_inten, RLEDataChunk):
+        spike_counts = spike_counts.toarray() #The run sums of the spike counts are dense anyway
+    sum_spikes = np.asarray(spike_counts.sum(axis=0)).reshape(-1)
     len_stim = len(stim_inten)
 
     #We just have to calculate one STA over the whole record
-    stim_inten   = np.reshape(stim_inten, (len(stim_inten),-1))
-    stim_inten   = np.transpose(stim_inten)
-    allCells_sta = staEst_fromBins(stim_inten, spike_counts, Hw, Fw=Fw)
+    if sp_sparse.issparse(spike_counts):
+        stim_inten   = np.reshape(stim_inten, (len(stim_inten),-1))
+        stim_inten   = np.transpose(stim_inten)
+        allCells_sta = staEst_fromSparse(stim_inten, spike_counts, Hw, Fw=Fw)
+    elif isinstance(stim_inten, RLEDataChunk):
+        run_values   = np.reshape(stim_inten.values, (len(stim_inten.values),-1))
+        run_values   = np.transpose(run_values)
+        allCells_sta = staEst_fromRuns(run_values, stim_inten.lengths, spike_counts, Hw, Fw=Fw)
+    else:
+        stim_inten   = np.reshape(stim_inten, (len(stim_inten),-1))
+        stim_inten   = np.transpose(stim_inten)
+        allCells_sta = staEst_fromBins(stim_inten, spike_counts, Hw, Fw=Fw)
 
     if len(orig_shape)==3:
         allCells_sta = allCells_sta.reshape((len(allCells_sta),Hw+Fw, orig_shape[-2], orig_shape[-1]))
@@ -263,6 +283,7 @@ def staEst_fromBins(stim, spike_counts, Hw, Fw=0):
     return:
         - STA of shape (n_cell, Hw+Fw, flattened_frame)
     """
+    spike_counts = np.array(spike_counts, dtype=float)
     spike_counts[:Hw] = 0
 
     spike_counts = np.nan_to_num(spike_counts / np.sum(spike_counts,axis=0))
@@ -280,6 +301,88 @@ def staEst_fromBins(stim, spike_counts, Hw, Fw=0):
     spike_counts = np.roll(spike_counts, -Fw, axis=0)
     return np.transpose(sta, (2,0,1))
 
+def staEst_fromRuns(run_values, lengths, spike_counts, Hw, Fw=0):
+    """
+    Same as staEst_fromBins for a stimulus made of runs of repeated frames. The spike counts are summed
+    over each run, so that the dot products are made with the n_run frames instead of the t frames.
+
+    params:
+        - run_values: stimulus intensity matrix of the runs of shape (flattened_frame, n_run)
+        - lengths: Number of frames of each run, summing to t
+        - spike_counts: cells activity matrix of shape (t, n_cell)
+        - Hw: Lenght in frames of the history window, including the 0 timepoint
+        - Fw: Lenght in frames of the forward window
+
+    return:
+        - STA of shape (n_cell, Hw+Fw, flattened_frame)
+    """
+    spike_counts = np.array(spike_counts, dtype=float)
+    spike_counts[:Hw] = 0
+
+    spike_counts = np.nan_to_num(spike_counts / np.sum(spike_counts,axis=0))
+    spike_counts = spike_counts - np.mean(spike_counts, axis=0)
+    stops  = np.cumsum(lengths)
+    starts = stops - lengths
+    len_t  = len(spike_counts)
+
+    def shifted_run_sums(counts):
+        #Cumulative sum over two periods, so that the sum over a run of the counts shifted
+        #(circularly, like np.roll) by s frames is cumsum[stops+s]-cumsum[starts+s]
+        cumsum = np.cumsum(np.concatenate((counts, counts)), axis=0)
+        cumsum = np.concatenate((np.zeros((1, counts.shape[-1])), cumsum))
+        return lambda shift: cumsum[stops+shift] - cumsum[starts+shift]
+
+    sta = np.zeros((Hw+Fw, run_values.shape[0], spike_counts.shape[-1]))
+    run_sums = shifted_run_sums(spike_counts)
+    for i in range(Hw):
+        sta[(Hw-1-i),:,:] = np.dot(run_values, run_sums(i))
+    if Fw != 0:
+        spike_counts[-Fw:] = 0
+    run_sums = shifted_run_sums(spike_counts)
+    for i in range(Fw):
+        sta[Hw+i,:,:] = np.dot(run_values, run_sums(len_t-(i+1)))
+    return np.transpose(sta, (2,0,1))
+
+def staEst_fromSparse(stim, spike_counts, Hw, Fw=0):
+    """
+    Same as staEst_fromBins for spike counts given as a scipy.sparse matrix. Instead of centering the
+    spike counts, which would make them dense, their mean is removed from the dot products.
+
+    params:
+        - stim: stimulus intensity matrix of shape (flattened_frame, t)
+        - spike_counts: sparse cells activity matrix of shape (t, n_cell)
+        - Hw: Lenght in frames of the history window, including the 0 timepoint
+        - Fw: Lenght in frames of the forward window
+
+    return:
+        - STA of shape (n_cell, Hw+Fw, flattened_frame)
+    """
+    len_t     = spike_counts.shape[0]
+    kept_bins = np.ones(len_t)
+    kept_bins[:Hw] = 0
+    spike_counts = sp_sparse.diags(kept_bins) @ sp_sparse.csr_matrix(spike_counts, dtype=float)
+
+    sum_spikes   = np.asarray(spike_counts.sum(axis=0)).reshape(-1)
+    inv_sum      = np.divide(1, sum_spikes, out=np.zeros(len(sum_spikes)), where=sum_spikes!=0)
+    spike_counts = sp_sparse.csr_matrix(spike_counts @ sp_sparse.diags(inv_sum))
+    mean_counts  = np.asarray(spike_counts.mean(axis=0)).reshape(-1)
+
+    def shifted_dot(counts, weights, shift):
+        #Dot product of the stimulus with the centered counts rolled by -shift, like np.roll
+        rows = (np.arange(len_t)+shift) % len_t
+        return (counts[rows].T @ stim.T).T - np.outer(stim @ weights[rows], mean_counts)
+
+    sta = np.zeros((Hw+Fw, stim.shape[0], spike_counts.shape[-1]))
+    for i in range(Hw):
+        sta[(Hw-1-i),:,:] = shifted_dot(spike_counts, np.ones(len_t), i)
+    if Fw != 0:
+        kept_bins = np.ones(len_t)
+        kept_bins[-Fw:] = 0
+        spike_counts = sp_sparse.csr_matrix(sp_sparse.diags(kept_bins) @ spike_counts)
+        for i in range(Fw):
+            sta[Hw+i,:,:] = shifted_dot(spike_counts, kept_bins, -(i+1))
+    return np.transpose(sta, (2,0,1))
+
 def process_sta_batch_large(stim_inten, spike_counts, Hw=30, Fw=2, return_pval=False, normalisation="abs", bs=1000):
     """
     Computes the STA and associated pvalues in parallel for a batch of cells, for a large stimulus.
@@ -296,6 +399,8 @@ def process_sta_batch_large(stim_inten, spike_counts, Hw=30, Fw=2, return_pval=F
     return:
         - stas of shape (n_cell, Hw+Fw, ...)
         - stas and pvalues if return_pval=True, both of shape (n_cell, Hw+Fw, ...)
+
+    A stim_inten given as a RLEDataChunk is used without expanding its frames (see `staEst_fromRuns`).
     """
     orig_shape = stim_inten.shape
     n_spatial_dim = orig_shape[1]*orig_shape[2]
@@ -303,13 +408,21 @@ def process_sta_batch_large(stim_inten, spike_counts, Hw=30, Fw=2, return_pval=F
     sum_spikes = np.sum(spike_counts, axis=0)
     len_stim = len(stim_inten)
     allCells_sta = np.zeros((n_spatial_dim, spike_counts.shape[1], Hw+Fw))
-    stim_inten = stim_inten.reshape((len_stim,-1))
+    if isinstance(stim_inten, RLEDataChunk):
+        lengths    = stim_inten.lengths
+        stim_inten = np.reshape(stim_inten.values, (len(stim_inten.values),-1))
+    else:
+        lengths    = None
+        stim_inten = stim_inten.reshape((len_stim,-1))
     print("Computing the STA part by part:")
     for i, batch_pos in enumerate(range(0, n_spatial_dim, bs)):
         print(str(round(100*batch_pos/n_spatial_dim,2))+"%      ", end="\r", flush=True)
         #Computing STA on partial portions of the screen sequentially
         stim_part = stim_inten_norm(stim_inten[:, batch_pos:batch_pos+bs]).T
-        sub_sta = staEst_fromBins(stim_part, spike_counts, Hw, Fw=Fw)
+        if lengths is None:
+            sub_sta = staEst_fromBins(stim_part, spike_counts, Hw, Fw=Fw)
+        else:
+            sub_sta = staEst_fromRuns(stim_part, lengths, spike_counts, Hw, Fw=Fw)
         allCells_sta[batch_pos:batch_pos+bs] = np.transpose(sub_sta, (2,0,1))#(ncell,Hw,stim_len) to (stim_len,ncell,Hw)
     allCells_sta = np.transpose(allCells_sta, (1,2,0))
     print("100%      ")
@@ -379,11 +492,21 @@ def corrcoef(spike_counts):
     Computes correlation coefficient between the cells
 
     params:
-        - spike_counts: Cells activity of shape (t, n_cell)
+        - spike_counts: Cells activity of shape (t, n_cell), dense or sparse (SparseDataChunk or scipy.sparse)
 
     return:
         - Correlation matrix
     """
+    if isinstance(spike_counts, SparseDataChunk):
+        spike_counts = spike_counts.matrix
+    if sp_sparse.issparse(spike_counts):
+        #Covariance from the sparse product, without centering the spike counts
+        len_t  = spike_counts.shape[0]
+        mean   = np.asarray(spike_counts.mean(axis=0)).reshape(-1)
+        cov    = (spike_counts.T @ spike_counts).toarray() - len_t*np.outer(mean, mean)
+        stddev = np.sqrt(np.diag(cov))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.clip(cov / np.outer(stddev, stddev), -1, 1)
     return np.corrcoef(spike_counts.T)
 
 def flatten_corrcoef(corrcoef_matrix):
@@ -414,7 +537,7 @@ def stimulus_ensemble(stim_inten, Hw=30, x=0, y=0, w=None, h=None):
     return:
         - Flatten stimulus ensemble of size (len(stim_inten)-Hw, w*h)
     """
-    stim_inten = stim_inten_norm(stim_inten)
+    stim_inten = np.asarray(stim_inten_norm(stim_inten)) #The ensemble holds every frame anyway
     if w is None:
         w = stim_inten.shape[2]
     if h is None:
@@ -422,7 +545,7 @@ def stimulus_ensemble(stim_inten, Hw=30, x=0, y=0, w=None, h=None):
     xmin, xmax = max(0,x-w), min(stim_inten.shape[2], x+w+1)
     ymin, ymax = max(0,y-h), min(stim_inten.shape[1], y+h+1)
     dtype = stim_inten.dtype
-    if np.all(np.in1d(stim_inten, [-1,0,1])):
+    if np.all(np.isin(stim_inten, [-1,0,1])):
         dtype = "int8"
     stim_ensmbl = np.zeros((len(stim_inten)-Hw, (xmax-xmin)*(ymax-ymin)*Hw), dtype=dtype)
     for i in range(Hw, len(stim_inten)):
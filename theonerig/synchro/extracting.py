@@ -12,6 +12,7 @@ import re
 
 from .io import *
 from ..utils import *
+from ..core import RLEDataChunk, compact_dtype
 
 def get_QDSpy_logs(log_dir):
     """Factory function to generate QDSpy_log objects from all the QDSpy logs of the folder `log_dir`"""
@@ -129,11 +130,13 @@ class Stimulus:
         return self.__str__()
 
 # Cell
-def unpack_stim_npy(npy_dir, md5_hash):
+def unpack_stim_npy(npy_dir, md5_hash, rle=False, compact=False):
     """Find the stimuli of a given hash key in the npy stimulus folder. The stimuli are in a compressed version
     comprising three files. inten for the stimulus values on the screen, marker for the values of the marker
     read by a photodiode to get the stimulus timing during a record, and an optional shader that is used to
-    specify informations about a shader when used, like for the moving gratings."""
+    specify informations about a shader when used, like for the moving gratings.
+    With rle=True, the intensities are kept compressed in a RLEDataChunk (of idx 0) instead of being unpacked.
+    With compact=True, the arrays are unpacked with their `compact_dtype` instead of float64."""
 
     #Stimuli can be either npy or npz (useful when working remotely)
     def find_file(ftype):
@@ -147,19 +150,26 @@ def unpack_stim_npy(npy_dir, md5_hash):
 
     inten  = find_file("intensities")
     marker = find_file("marker")
+    #The dtype is found on the compressed arrays, before unpacking
+    unpack_dtype = lambda arr: compact_dtype(arr) if compact else float
 
     shader, unpack_shader = None, None
     if len(glob.glob(os.path.join(npy_dir, "*_shader_"+md5_hash+".np*")))>0:
         shader        = find_file("shader")
-        unpack_shader = np.empty((np.sum(marker[:,0]), *shader.shape[1:]))
+        unpack_shader = np.empty((np.sum(marker[:,0]), *shader.shape[1:]), dtype=unpack_dtype(shader))
 
     #The latter unpacks the arrays
-    unpack_inten  = np.empty((np.sum(marker[:,0]), *inten.shape[1:]))
-    unpack_marker = np.empty(np.sum(marker[:,0]))
+    if rle:
+        run_values   = inten.astype(compact_dtype(inten)) if compact else inten
+        unpack_inten = RLEDataChunk(run_values, marker[:,0], idx=0, group="stim")
+    else:
+        unpack_inten = np.empty((np.sum(marker[:,0]), *inten.shape[1:]), dtype=unpack_dtype(inten))
+    unpack_marker = np.empty(np.sum(marker[:,0]), dtype=unpack_dtype(marker[:,1]))
 
     cursor = 0
     for i, n_frame in enumerate(marker[:,0]):
-        unpack_inten[cursor:cursor+n_frame] = inten[i]
+        if not rle:
+            unpack_inten[cursor:cursor+n_frame] = inten[i]
         unpack_marker[cursor:cursor+n_frame] = marker[i, 1]
         if shader is not None:
             unpack_shader[cursor:cursor+n_frame] = shader[i]
@@ -12,6 +12,8 @@ import glob
 import os
 from scipy import signal
 
+from ..core import RLEDataChunk, rle_encode
+
 # Cell
 def get_thresholds(data):
     """Function that attempts to get the high and low thresholds. Not working very well"""
@@ -221,12 +223,16 @@ def frame_error_correction(signals, unpacked, algo="nw", **kwargs):
     `shift_detection_conv` or `shift_detection_NW` and applied to the stimulus template. Then single frame
     mismatch are detected and corrected.
         - signals: true signal values recorded
-        - unpacked: stimulus tuple (inten,marker,shader)
+        - unpacked: stimulus tuple (inten,marker,shader). A RLEDataChunk inten is corrected on its expanded
+        frames and encoded back.
         - algo: algorithm for shift detection among [nw, conv]
         - **kwargs: extra parameter for shift detection functions
 
         returns: stim_tuple_corrected, shift_log, (error_frames_idx, replacement_idx)"""
 
+    rle = isinstance(unpacked[0], RLEDataChunk)
+    if rle:
+        unpacked = (np.asarray(unpacked[0]), *unpacked[1:])
     if algo=="no_shift":
         intensity, marker, shader  = unpacked[0].copy(), unpacked[1].copy(), unpacked[2]
         if shader is not None:
@@ -245,6 +251,8 @@ def frame_error_correction(signals, unpacked, algo="nw", **kwargs):
         marker[error_frames]       = marker[replacements]
         if shader is not None:
             shader[error_frames] = shader[replacements]
+    if rle:
+        intensity = rle_encode(intensity, 0)
     return (intensity, marker, shader), shift_log, list(zip(map(int,error_frames), map(int,replacements)))
 
 def error_frame_matches(signals, marker, range_):
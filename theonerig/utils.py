@@ -1,9 +1,11 @@
 # AUTOGENERATED! DO NOT EDIT! File to edit: 01_utils.ipynb (unless otherwise specified).
 
-__all__ = ['extend_sync_timepoints', 'align_sync_timepoints', 'resample_to_timepoints', 'flip_stimulus',
-           'flip_gratings', 'stim_to_dataChunk', 'phy_results_dict', 'spike_to_dataChunk', 'get_calcium_stack_lenghts',
-           'twoP_dataChunks', 'img_2d_fit', 'fill_nan', 'stim_inten_norm', 'group_direction_response',
-           'group_chirp_bumps', 'get_repeat_corrected', 'buszaki_shank_channels', 'format_pval', 'stim_recap_df']
+__all__ = ['extend_sync_timepoints', 'align_sync_timepoints', 'resample_to_timepoints', 'bin_to_timepoints',
+           'flip_stimulus', 'flip_gratings', 'stim_to_dataChunk', 'ClusterIndex', 'build_cluster_index',
+           'load_cluster_index', 'PhyResults', 'phy_results_dict', 'spike_to_dataChunk', 'phy_spike_to_dataChunk',
+           'get_calcium_stack_lenghts', 'twoP_dataChunks', 'img_2d_fit', 'fill_nan', 'stim_inten_norm',
+           'group_direction_response', 'group_chirp_bumps', 'get_repeat_corrected', 'buszaki_shank_channels',
+           'format_pval', 'stim_recap_df']
 
 # Cell
 import numpy as np
@@ -11,8 +13,11 @@ import pandas as pd
 import os
 import glob
 import re
+from collections.abc import MutableMapping
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, Tuple, Sequence, Union, Callable
 import scipy.interpolate as interpolate
+import scipy.sparse as sp_sparse
 from scipy.ndimage import convolve1d
 
 from .core import *
@@ -158,6 +163,65 @@ def resample_to_timepoints(timepoints:np.ndarray, data:np.ndarray,
     idx = ref_timepoints.idx + start_idx
     return DataChunk(data=new_data, idx = idx, group=group)
 
+# Cell
+def bin_to_timepoints(timepoints:np.ndarray, data, ref_timepoints:DataChunk, how:str="mean",
+                      group="data", dtype=np.float64, chunk_len:int=2**20):
+    """
+    Bin the data at timepoints into the time bins of ref_timepoints (from each reference timepoint
+    to the next), for downsampling signals recorded at a higher rate than the reference, like eye
+    tracking, treadmill or multi-channel signals. Unlike resample_to_timepoints, the bins of all
+    channels are reduced in a single pass with `searchsorted` and `np.add.reduceat`, streaming over
+    blocks of chunk_len samples so that memory-mapped data is never fully loaded.
+    Bins without samples (when upsampling) hold the value of the previous bin, or 0 for "sum".
+
+    params:
+        - timepoints: Original timepoints of the data, sorted
+        - data: Data to resample of shape (t, ...), or list of such arrays sharing the timepoints
+        - ref_timepoints: Target timepoints for the resampling
+        - how: Reduction of the samples of each bin, one of ["mean", "sum", "last"]
+        - group: Group assigned to the returned DataChunk
+        - dtype: dtype of the returned data, like np.float32 to halve its memory
+        - chunk_len: Number of samples read at once
+
+    return:
+        - Resampled datachunk with appropriate idx, or list of datachunk if data is a list
+    """
+    assert how in ["mean", "sum", "last"], "how must be one of ['mean', 'sum', 'last']"
+    if isinstance(data, (list, tuple)):
+        return [bin_to_timepoints(timepoints, d, ref_timepoints, how, group, dtype, chunk_len) for d in data]
+    assert len(timepoints) == len(data)
+
+    edges  = np.concatenate((ref_timepoints[:], [(ref_timepoints[-1]*2)-ref_timepoints[-2]]))
+    start  = max(int(np.searchsorted(edges, timepoints[0], side="right"))-1, 0)
+    stop   = min(int(np.searchsorted(edges, timepoints[-1], side="right")), len(ref_timepoints))
+    #Samples of the bin i are data[bounds[i]:bounds[i+1]]
+    bounds = np.searchsorted(timepoints, edges[start:stop+1], side="left")
+    counts = np.diff(bounds)
+
+    new_data = np.zeros((stop-start, *data.shape[1:]), dtype=dtype)
+    b0 = 0
+    while b0 < stop-start:
+        b1 = min(max(np.searchsorted(bounds, bounds[b0]+chunk_len, side="right")-1, b0+1), stop-start)
+        s0, s1 = bounds[b0], bounds[b1]
+        nonempty = np.flatnonzero(counts[b0:b1]) + b0
+        if len(nonempty):
+            block = np.asarray(data[s0:s1])
+            if how == "last":
+                new_data[nonempty] = block[bounds[nonempty+1]-1-s0]
+            else:
+                sums = np.add.reduceat(block, bounds[nonempty]-s0, axis=0, dtype=np.float64)
+                if how == "mean":
+                    sums /= counts[nonempty].reshape(-1, *[1]*(block.ndim-1))
+                new_data[nonempty] = sums
+        b0 = b1
+
+    if how != "sum" and len(new_data):
+        #Empty bins take the value of the previous non-empty bin
+        held = np.where(counts > 0, np.arange(len(counts)), 0)
+        new_data = new_data[np.maximum.accumulate(held)]
+
+    return DataChunk(data=new_data, idx=ref_timepoints.idx + start, group=group)
+
 # Cell
 def flip_stimulus(stim_inten, ud_inv, lr_inv):
     """
@@ -172,6 +236,8 @@ def flip_stimulus(stim_inten, ud_inv, lr_inv):
     return:
         - Flipped stimulus array
     """
+    if isinstance(stim_inten, RLEDataChunk):
+        return stim_inten.map_values(lambda values: flip_stimulus(values, ud_inv, lr_inv))
     if lr_inv:
         stim_inten = np.flip(stim_inten, axis=3) # Axis 0:t 1:color 2:y 3:x
     if not ud_inv:
@@ -195,6 +261,7 @@ def flip_gratings(stim_shader, ud_inv, lr_inv):
     return:
         - Flipped grating array
     """
+    stim_shader = np.array(stim_shader)
     mask_epochs = ~np.all(stim_shader==0,axis=1)
     if lr_inv:
         stim_shader[mask_epochs,1] = (360 + (180 - stim_shader[mask_epochs,1])) % 360
@@ -214,37 +281,198 @@ def stim_to_dataChunk(stim_inten, stim_start_idx, reference:DataChunk) -> DataCh
     return:
         - Datachunk of the stimulus
     """
+    if isinstance(stim_inten, RLEDataChunk):
+        stim_chunk = stim_inten.map_values(np.squeeze)
+        stim_chunk.idx = stim_start_idx + reference.idx
+        return stim_chunk
     return DataChunk(data=np.squeeze(stim_inten), idx = (stim_start_idx + reference.idx), group="stim")
 
 # Cell
+class ClusterIndex():
+    """
+    CSR-like index of the spikes of each cluster: the indexes of the spikes ordered by cluster (stable
+    argsort of spike_clusters, so the spikes of a cluster stay in time order), and the offsets of each
+    cluster in them. Built once in O(n log n), it then gives the spikes of any cluster without scanning
+    all the spikes. Create it with `build_cluster_index`, or `load_cluster_index` after `save`.
+
+    params:
+        - order: Indexes of the spikes sorted by cluster
+        - clusters: Sorted ids of the clusters
+        - offsets: Start of the spikes of each cluster in order, followed by the number of spikes
+    """
+    def __init__(self, order:np.ndarray, clusters:np.ndarray, offsets:np.ndarray):
+        self.order    = order
+        self.clusters = clusters
+        self.offsets  = offsets
+
+    def slice(self, cluster) -> slice:
+        """Slice of the spikes of cluster in order, or in an array sorted with `cluster_sort`"""
+        i = np.searchsorted(self.clusters, cluster)
+        if i == len(self.clusters) or self.clusters[i] != cluster:
+            return slice(0, 0)
+        return slice(int(self.offsets[i]), int(self.offsets[i+1]))
+
+    def spikes(self, cluster) -> np.ndarray:
+        """Indexes of the spikes of cluster, in time order (view of self.order)"""
+        return self.order[self.slice(cluster)]
+
+    def cluster_sort(self, array:np.ndarray) -> np.ndarray:
+        """Copy of a per-spike array (spike_times, amplitudes, ...) in the order of the clusters. The values
+        of a cluster are then the view `sorted_array[cluster_index.slice(cluster)]`"""
+        return np.asarray(array)[self.order]
+
+    def n_spikes(self, cluster) -> int:
+        cluster_slice = self.slice(cluster)
+        return cluster_slice.stop - cluster_slice.start
+
+    def save(self, path):
+        """Saves the index in a .npz file, to be reloaded with `load_cluster_index`"""
+        np.savez(path, order=self.order, clusters=self.clusters, offsets=self.offsets)
+
+    def __contains__(self, cluster):
+        return self.n_spikes(cluster) > 0
+
+    def __len__(self):
+        return len(self.clusters)
+
+    def __repr__(self):
+        return "ClusterIndex(%d clusters, %d spikes)" % (len(self.clusters), len(self.order))
+
+def build_cluster_index(spike_clusters) -> ClusterIndex:
+    """Builds the ClusterIndex of the cluster of each spike (spike_clusters of phy)"""
+    spike_clusters = np.asarray(spike_clusters).reshape(-1)
+    order = np.argsort(spike_clusters, kind="stable")
+    clusters, starts = np.unique(spike_clusters[order], return_index=True)
+    return ClusterIndex(order, clusters, np.append(starts, len(order)))
+
+def load_cluster_index(path) -> ClusterIndex:
+    """Loads a ClusterIndex saved with `ClusterIndex.save`"""
+    with np.load(path) as npz_f:
+        return ClusterIndex(npz_f["order"], npz_f["clusters"], npz_f["offsets"])
+
+class PhyResults(MutableMapping):
+    """
+    Lazy dictionary of the result arrays of phy. Each array is memory-mapped read-only from its
+    .npy file on its first access, so unused arrays (like the large templates.npy) are never read.
+    Other entries can be set like in a dict.
+
+    The spikes of each cluster are given by a ClusterIndex built once (`cluster_index`), or loaded
+    from the phy directory if it was saved there with `save_cluster_index` after the last change of
+    spike_clusters.npy. See `cluster_spikes` and `cluster_array`. Like phy, spike_clusters falls back to
+    spike_templates.npy in a directory without spike_clusters.npy (before any manual merge).
+
+    params:
+        - phy_dir: path to the phy results
+    """
+    PHY_ARRAYS = ["amplitudes", "channel_map", "channel_positions", "spike_clusters",
+                  "spike_templates", "spike_times", "templates"]
+    CLUSTER_INDEX_FILE = "cluster_index.npz"
+
+    def __init__(self, phy_dir):
+        self.phy_dir         = phy_dir
+        self._arrays         = {}
+        self._keys           = list(self.PHY_ARRAYS)
+        self._cluster_index  = None
+        self._sorted_arrays  = {} #Arrays in the order of the cluster index
+        self._clusters_set   = False #True when spike_clusters is not the one of the phy directory
+
+    def __getitem__(self, key):
+        if key not in self._arrays:
+            if key not in self._keys:
+                raise KeyError(key)
+            path = self._clusters_path() if key == "spike_clusters" else os.path.join(self.phy_dir, key+".npy")
+            self._arrays[key] = np.load(path, mmap_mode="r")
+        return self._arrays[key]
+
+    def _clusters_path(self):
+        """File of spike_clusters, or of spike_templates for a directory not curated with phy"""
+        path = os.path.join(self.phy_dir, "spike_clusters.npy")
+        return path if os.path.exists(path) else os.path.join(self.phy_dir, "spike_templates.npy")
+
+    def __setitem__(self, key, value):
+        self._reset_sorted(key)
+        if key not in self._keys:
+            self._keys.append(key)
+        self._arrays[key] = value
+
+    def __delitem__(self, key):
+        if key not in self._keys:
+            raise KeyError(key)
+        self._reset_sorted(key)
+        self._keys.remove(key)
+        self._arrays.pop(key, None)
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def _reset_sorted(self, key):
+        if key == "spike_clusters":
+            self._cluster_index = None
+            self._sorted_arrays = {}
+            self._clusters_set  = True
+        else:
+            self._sorted_arrays.pop(key, None)
+
+    @property
+    def cluster_index(self) -> ClusterIndex:
+        """ClusterIndex of spike_clusters, built on the first access or loaded from the phy directory"""
+        if self._cluster_index is None:
+            path = os.path.join(self.phy_dir, self.CLUSTER_INDEX_FILE)
+            if (not self._clusters_set and os.path.exists(path)
+                    and os.path.getmtime(path) >= os.path.getmtime(self._clusters_path())):
+                self._cluster_index = load_cluster_index(path)
+            else:
+                self._cluster_index = build_cluster_index(self["spike_clusters"])
+        return self._cluster_index
+
+    def save_cluster_index(self):
+        """Saves the ClusterIndex in the phy directory, to be reused by the next `phy_results_dict`"""
+        self.cluster_index.save(os.path.join(self.phy_dir, self.CLUSTER_INDEX_FILE))
+
+    def cluster_spikes(self, cluster) -> np.ndarray:
+        """Indexes of the spikes of cluster in the phy arrays (spike_times, amplitudes, ...).
+        Equivalent to `np.where(phy_dict["spike_clusters"]==cluster)[0]`"""
+        return self.cluster_index.spikes(cluster)
+
+    def cluster_array(self, key, cluster) -> np.ndarray:
+        """Values of the per-spike array key (spike_times, spike_templates, amplitudes, ...) for the spikes of
+        cluster, in time order. The array is sorted by cluster once, and the values returned are a view of it."""
+        if key not in self._sorted_arrays:
+            self._sorted_arrays[key] = self.cluster_index.cluster_sort(self[key])
+        return self._sorted_arrays[key][self.cluster_index.slice(cluster)]
+
+    def __repr__(self):
+        return "PhyResults(%s, loaded=%s)" % (self.phy_dir, sorted(self._arrays.keys()))
+
 def phy_results_dict(phy_dir):
     """
-    Open the result arrays of spike sorting after manual merging with phy.
+    Open the result arrays of spike sorting after manual merging with phy. The arrays are
+    memory-mapped from their file on their first access (see `PhyResults`).
 
     params:
         - phy_dir: path to the phy results
 
     return:
-        - Dictionnary of the phy arrays (amplitudes, channel_map, channel_positions, spike_clusters,
+        - Lazy dictionnary of the phy arrays (amplitudes, channel_map, channel_positions, spike_clusters,
         spike_templates, spike_times, templates)
     """
-    res_dict = {}
-    res_dict["amplitudes"] = np.load(phy_dir+"/amplitudes.npy")
-    res_dict["channel_map"] = np.load(phy_dir+"/channel_map.npy")
-    res_dict["channel_positions"] = np.load(phy_dir+"/channel_positions.npy")
-    res_dict["spike_clusters"] = np.load(phy_dir+"/spike_clusters.npy")
-    res_dict["spike_templates"] = np.load(phy_dir+"/spike_templates.npy")
-    res_dict["spike_times"] = np.load(phy_dir+"/spike_times.npy")
-    res_dict["templates"] = np.load(phy_dir+"/templates.npy")
-    return res_dict
+    return PhyResults(phy_dir)
 
-def spike_to_dataChunk(spike_timepoints, ref_timepoints:DataChunk) -> DataChunk:
+def spike_to_dataChunk(spike_timepoints, ref_timepoints:DataChunk, sparse:bool=False, compact:bool=False) -> DataChunk:
     """
     Factory function of a DataChunk for spiking count of cells from spike timepoints.
 
     params:
         - spike_timepoints: Dictionnary of the cells spike timepoints (list)
         - ref_timepoints: Reference DataChunk to align the newly created spike count Datachunk
+        - sparse: If True, returns a SparseDataChunk that only stores the non-zero spike counts
+        - compact: If True, the spike counts are stored with their `compact_dtype` (uint8 or uint16 usually)
 
     return:
         - Spike count datachunk of shape (t, n_cell)
@@ -253,16 +481,115 @@ def spike_to_dataChunk(spike_timepoints, ref_timepoints:DataChunk) -> DataChunk:
     cell_keys = sorted(map(int,
                                     spike_timepoints.keys()))
     cell_map = dict([ (cell_key, i) for i, cell_key in enumerate(cell_keys) ])
-    spike_bins = np.zeros((ref_timepoints.shape[0], len(cell_keys)))
-    bins = np.concatenate((ref_timepoints[:], [(ref_timepoints[-1]*2)-ref_timepoints[-2]]))
+    bins = _spike_bin_edges(ref_timepoints)
+
+    #Groups of cells are binned together, to bound the memory of the bincount to ~2**22 bins
+    group_len = max(1, 2**22 // len(bins))
+    def spike_chunks():
+        for start in range(0, len(cell_keys), group_len):
+            group_keys = cell_keys[start:start+group_len]
+            times = [np.asarray(spike_timepoints[type_cast(cell)]).reshape(-1) for cell in group_keys]
+            yield np.concatenate(times), np.repeat(np.arange(start, start+len(group_keys)), [len(t) for t in times])
+
+    spike_bins = _bin_spikes(spike_chunks(), bins, len(cell_keys), sparse)
+    return _spike_count_datachunk(spike_bins, ref_timepoints, cell_map, compact)
 
-    for i, cell in enumerate(cell_keys):
-        spike_bins[:, i] = np.histogram(spike_timepoints[type_cast(cell)], bins)[0]
+def _spike_bin_edges(ref_timepoints:DataChunk) -> np.ndarray:
+    """Edges of the time bins of the spike counts, one per reference timepoint and one after the last"""
+    return np.concatenate((ref_timepoints[:], [(ref_timepoints[-1]*2)-ref_timepoints[-2]]))
+
+def _bin_spikes(spike_chunks, bins:np.ndarray, n_cell:int, sparse:bool=False):
+    """
+    Counts the spikes in the time bins delimited by the edges bins (the last bin includes its right
+    edge, like np.histogram). The spikes are given as an iterable of (spike_times, cell_indexes) chunks,
+    each binned at once with a single searchsorted and a bincount keyed by (bin, cell). Spikes with a
+    negative cell index or outside of the bins are ignored.
 
-    datachunk = DataChunk(data=spike_bins, idx = ref_timepoints.idx, group="cell")
+    return:
+        - The spike counts of shape (n_bin, n_cell), as a CSR matrix if sparse
+    """
+    n_bin = len(bins)-1
+    spike_bins = None if sparse else np.zeros((n_bin, n_cell))
+    keys_l, counts_l = [], []
+    for spike_times, cell_idx in spike_chunks:
+        spike_times = np.asarray(spike_times)
+        bin_idx     = np.searchsorted(bins, spike_times, side="right") - 1
+        bin_idx[spike_times == bins[-1]] = n_bin-1
+        valid       = (bin_idx >= 0) & (bin_idx < n_bin) & (cell_idx >= 0)
+        bin_idx, cell_idx = bin_idx[valid], np.asarray(cell_idx, dtype=np.int64)[valid]
+        if len(bin_idx) == 0:
+            continue
+        if sparse:
+            keys, counts = np.unique(bin_idx*n_cell + cell_idx, return_counts=True)
+            keys_l.append(keys)
+            counts_l.append(counts)
+        else:
+            #Only the block of bins and cells covered by the chunk is counted
+            bin_first, bin_last   = bin_idx.min(), bin_idx.max()
+            cell_first, cell_last = cell_idx.min(), cell_idx.max()
+            block_shape = (bin_last-bin_first+1, cell_last-cell_first+1)
+            block = np.bincount((bin_idx-bin_first)*block_shape[1] + cell_idx-cell_first,
+                                minlength=block_shape[0]*block_shape[1])
+            spike_bins[bin_first:bin_last+1, cell_first:cell_last+1] += block.reshape(block_shape)
+    if sparse:
+        keys   = np.concatenate(keys_l) if keys_l else np.zeros(0, dtype=np.int64)
+        counts = np.concatenate(counts_l).astype(float) if counts_l else np.zeros(0)
+        spike_bins = sp_sparse.csr_matrix((counts, (keys//n_cell, keys%n_cell)), shape=(n_bin, n_cell))
+    return spike_bins
+
+def _spike_count_datachunk(spike_bins, ref_timepoints:DataChunk, cell_map:dict, compact:bool) -> DataChunk:
+    """DataChunk, or SparseDataChunk if spike_bins is sparse, of the spike counts aligned on ref_timepoints"""
+    if sp_sparse.issparse(spike_bins):
+        if compact:
+            spike_bins.data = spike_bins.data.astype(compact_dtype(spike_bins.data))
+        datachunk = SparseDataChunk(spike_bins, idx = ref_timepoints.idx, group="cell")
+    else:
+        datachunk = DataChunk(data=spike_bins, idx = ref_timepoints.idx, group="cell", compact=compact)
     datachunk.attrs["cell_map"] = cell_map
     return datachunk
 
+def phy_spike_to_dataChunk(phy_dir, ref_timepoints:DataChunk, clusters=None, sparse:bool=False, compact:bool=False,
+                           chunk_size:int=2**22) -> DataChunk:
+    """
+    Factory function of a DataChunk for spiking count of cells from the spike_times.npy and spike_clusters.npy
+    files of phy. The files are memory-mapped and binned by chunks of spikes, in a single pass that does not
+    load them in memory.
+
+    params:
+        - phy_dir: path to the phy results
+        - ref_timepoints: Reference DataChunk to align the newly created spike count Datachunk
+        - clusters: Clusters to count (e.g. the good clusters), in the order of the columns. Defaults to all clusters
+        - sparse: If True, returns a SparseDataChunk that only stores the non-zero spike counts
+        - compact: If True, the spike counts are stored with their `compact_dtype` (uint8 or uint16 usually)
+        - chunk_size: Number of spikes binned at once
+
+    return:
+        - Spike count datachunk of shape (t, n_cell), with the cell_map of the clusters to the columns in its attrs
+    """
+    spike_times    = np.load(os.path.join(phy_dir, "spike_times.npy"), mmap_mode="r").reshape(-1)
+    spike_clusters = np.load(os.path.join(phy_dir, "spike_clusters.npy"), mmap_mode="r").reshape(-1)
+    if len(spike_clusters) == 0: #No spike, the counts of the requested clusters are all zero
+        clusters = [] if clusters is None else clusters
+    elif clusters is None:
+        clusters = np.unique(np.concatenate([np.unique(spike_clusters[start:start+chunk_size])
+                                             for start in range(0, len(spike_clusters), chunk_size)]))
+    clusters = np.asarray(clusters, dtype=int)
+    cell_map = dict([ (int(cluster), i) for i, cluster in enumerate(clusters) ])
+    #Column of each cluster id, -1 for the clusters not counted
+    column_lut = np.full(max(clusters.max()+1, 0) if len(clusters) else 0, -1)
+    column_lut[clusters] = np.arange(len(clusters))
+
+    def spike_chunks():
+        for start in range(0, len(spike_times), chunk_size):
+            chunk_clusters = np.asarray(spike_clusters[start:start+chunk_size], dtype=np.int64)
+            cell_idx = np.full(len(chunk_clusters), -1)
+            in_lut   = chunk_clusters < len(column_lut)
+            cell_idx[in_lut] = column_lut[chunk_clusters[in_lut]]
+            yield np.asarray(spike_times[start:start+chunk_size]), cell_idx
+
+    spike_bins = _bin_spikes(spike_chunks(), _spike_bin_edges(ref_timepoints), len(clusters), sparse)
+    return _spike_count_datachunk(spike_bins, ref_timepoints, cell_map, compact)
+
 # Cell
 def get_calcium_stack_lenghts(folder):
     """
@@ -282,9 +609,24 @@ def get_calcium_stack_lenghts(folder):
             record_lenghts.append(int(re.findall(pattern_nFrame, line)[0]))
     return record_lenghts
 
-def twoP_dataChunks(ref_timepoints:DataChunk, frame_timepoints, len_epochs, C_matrix, S_matrix):
-    """
-    Factory function for two photon data.
+def _interp_rows(matrix:np.ndarray, positions:np.ndarray, dtype) -> np.ndarray:
+    """Linear interpolation of the rows of matrix at the fractional row positions, computed in dtype"""
+    lower  = np.clip(np.floor(positions).astype(int), 0, max(len(matrix)-2, 0))
+    upper  = np.minimum(lower+1, len(matrix)-1)
+    weight = (positions - lower).astype(dtype).reshape(-1, *[1]*(matrix.ndim-1))
+    res    = np.asarray(matrix[lower], dtype=dtype)
+    delta  = np.asarray(matrix[upper], dtype=dtype)
+    delta -= res
+    delta *= weight
+    res   += delta
+    return res
+
+def twoP_dataChunks(ref_timepoints:DataChunk, frame_timepoints, len_epochs, C_matrix, S_matrix,
+                    dtype=np.float32, n_jobs:int=4):
+    """
+    Factory function for two photon data. The frames of each epoch are linearly interpolated to the
+    reference timepoints it spans, for all the cells at once. The fractional frame positions of an
+    epoch are computed once for both matrices, and the epochs are processed in parallel threads.
 
     params:
         - ref_timepoints: Reference timepoints to create the DataChunk
@@ -292,27 +634,31 @@ def twoP_dataChunks(ref_timepoints:DataChunk, frame_timepoints, len_epochs, C_ma
         - len_epochs: Lenght of the recorded epochs (<= than the corresponding frame_timepoints)
         - C_matrix: C_matrix of all frames detected by CaImAn
         - S_matrix: S_matrix of all frames detected by CaImAn
+        - dtype: dtype of the interpolation and of the returned data
+        - n_jobs: Number of threads interpolating the epochs
 
     return:
         - C_datachunk_l: A list of C_matrix datachunks
         - S_datachunk_l: A list of S_matrix datachunks
     """
-    C_datachunk_l = []
-    S_datachunk_l = []
-    cursor = 0
-    for i, len_epoch in enumerate(len_epochs):
-        start_idx = np.argmax(ref_timepoints>frame_timepoints[i][0])
-        stop_idx  = np.argmax(ref_timepoints>frame_timepoints[i][len_epoch-1])
-        sub_C, sub_S = C_matrix.T[cursor:cursor+len_epoch], S_matrix.T[cursor:cursor+len_epoch]
-        cursor += len_epoch
-        f = interpolate.interp1d(range(len_epoch), sub_C, axis=0)
-        C_datachunk_l.append(DataChunk(data=f(np.linspace(0,len_epoch-1,stop_idx-start_idx)),
-                                       idx=start_idx,
-                                       group="cell"))
-        f = interpolate.interp1d(range(len_epoch), sub_S, axis=0)
-        S_datachunk_l.append(DataChunk(data=f(np.linspace(0,len_epoch-1,stop_idx-start_idx)),
-                                       idx=start_idx,
-                                       group="cell"))
+    ref_timepoints = np.asarray(ref_timepoints)
+    cursors = np.concatenate(([0], np.cumsum(len_epochs)))
+    def interp_epoch(i):
+        len_epoch = len_epochs[i]
+        start_idx = int(np.searchsorted(ref_timepoints, frame_timepoints[i][0], side="right"))
+        stop_idx  = int(np.searchsorted(ref_timepoints, frame_timepoints[i][len_epoch-1], side="right"))
+        positions = np.linspace(0, len_epoch-1, stop_idx-start_idx)
+        sub_C, sub_S = C_matrix.T[cursors[i]:cursors[i+1]], S_matrix.T[cursors[i]:cursors[i+1]]
+        return (DataChunk(data=_interp_rows(sub_C, positions, dtype), idx=start_idx, group="cell"),
+                DataChunk(data=_interp_rows(sub_S, positions, dtype), idx=start_idx, group="cell"))
+
+    if n_jobs > 1:
+        with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+            datachunks = list(executor.map(interp_epoch, range(len(len_epochs))))
+    else:
+        datachunks = [interp_epoch(i) for i in range(len(len_epochs))]
+    C_datachunk_l = [C_dc for C_dc, _ in datachunks]
+    S_datachunk_l = [S_dc for _, S_dc in datachunks]
     return (C_datachunk_l, S_datachunk_l)
 
 # Cell
@@ -345,6 +691,8 @@ def stim_inten_norm(stim_inten):
     """
     Normalize a stimulus with intensity in the 8bit range (0-255) to -1 to 1 range.
     """
+    if isinstance(stim_inten, RLEDataChunk):
+        return stim_inten.map_values(stim_inten_norm)
     stim_inten = stim_inten.astype(float)
     stim_inten -= np.min(stim_inten)
     stim_inten -= np.max(stim_inten)/2
@@ -368,7 +716,8 @@ def group_direction_response(stim_prop, spike_counts, n_repeat, n_cond=32):
     """
 
     n_cell = spike_counts.shape[-1]
-    condition_repeat = stim_prop.reshape(n_repeat*n_cond,-1,3)[:,10,:] #Take the condition for each repeat
+    len_epoch        = len(stim_prop)//(n_repeat*n_cond)
+    condition_repeat = stim_prop[np.arange(n_repeat*n_cond)*len_epoch+10] #Take the condition for each repeat
     # We take it at the 10th frame in case of frame replacement during synchronisation
     #(the 10th should be unchanged)
 
@@ -404,7 +753,7 @@ def group_chirp_bumps(stim_inten, spike_counts, n_repeat):
         - Dictionnary of cells response to the different ON or OFF stimuli
     """
 
-    repeat = stim_inten.reshape(n_repeat,-1)[0]
+    repeat = np.asarray(stim_inten[:len(stim_inten)//n_repeat]).reshape(-1)
     spike_counts = spike_counts.reshape(n_repeat,-1,spike_counts.shape[-1])
     epoch_l = [0]
     end_l = [len(repeat)]